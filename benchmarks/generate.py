@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+generate.py
+
+synthetic hdf5 files exercising the slow paths of h5nav
+
+- deep.h5: a chain of nested groups, each level holding a few siblings
+- wide.h5: a single group with a very large number of members
+- data.h5: large chunked/compressed and contiguous datasets, plus
+  variable-length string and compound datasets
+
+Usage: python benchmarks/generate.py [--scale small|full] [directory]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import argparse
+from os.path import isdir, join
+
+import numpy as np
+from h5py import File, special_dtype
+
+SCALES = {
+    'small': {'depth': 20, 'siblings': 3, 'width': 1000, 'rows': 2 ** 16},
+    'full': {'depth': 200, 'siblings': 10, 'width': 10 ** 5,
+             'rows': 2 ** 21},
+}
+COLUMNS = 16
+
+
+def deep(fname, depth, siblings, **_):
+    """Nested groups /level0/level1/..., with siblings and a dataset each"""
+    with File(fname, 'w') as h5f:
+        grp = h5f
+        for level in range(depth):
+            for sib in range(siblings):
+                grp.create_group("sibling{}".format(sib))
+            grp["values"] = np.arange(10)
+            grp = grp.create_group("level{}".format(level))
+
+
+def wide(fname, width, **_):
+    """Group /wide with `width` members, alternating groups and datasets"""
+    with File(fname, 'w', libver='latest') as h5f:
+        grp = h5f.create_group("wide")
+        for num in range(width):
+            if num % 2:
+                grp.create_group("group{:06d}".format(num))
+            else:
+                grp["dset{:06d}".format(num)] = num
+
+
+def data(fname, rows, **_):
+    """Large float datasets, chunked+compressed and contiguous, and
+    datasets of non numeric dtypes"""
+    rng = np.random.RandomState(0)
+    block = 2 ** 14
+    with File(fname, 'w') as h5f:
+        chunked = h5f.create_dataset("chunked", (rows, COLUMNS), 'f8',
+                                     chunks=(block // 16, COLUMNS),
+                                     compression='gzip', shuffle=True)
+        contiguous = h5f.create_dataset("contiguous", (rows, COLUMNS), 'f8')
+        for start in range(0, rows, block):
+            values = rng.normal(300., 20., (min(block, rows - start),
+                                            COLUMNS))
+            chunked[start:start + len(values)] = values
+            contiguous[start:start + len(values)] = values
+        nstr = rows // 64
+        strings = h5f.create_dataset("strings", (nstr,),
+                                     special_dtype(vlen=str))
+        strings[:] = ["value {}".format(num) for num in range(nstr)]
+        compound = np.zeros(rows // 16, dtype=[('x', 'f8'), ('y', 'f8'),
+                                               ('id', 'i4')])
+        compound['x'] = rng.uniform(size=len(compound))
+        compound['y'] = rng.uniform(size=len(compound))
+        compound['id'] = np.arange(len(compound))
+        h5f["compound"] = compound
+
+
+GENERATORS = [('deep', deep), ('wide', wide), ('data', data)]
+
+
+def generate(directory, scale='small', force=False):
+    """Create the synthetic files in `directory` if missing
+
+    Returns a dict mapping file keys ('deep', 'wide', 'data') to paths.
+    """
+    params = SCALES[scale]
+    if not isdir(directory):
+        os.makedirs(directory)
+    files = {}
+    for key, func in GENERATORS:
+        fname = join(directory, "{}-{}.h5".format(key, scale))
+        if force or not os.path.isfile(fname):
+            print("generating " + fname)
+            func(fname, **params)
+        files[key] = fname
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('directory', nargs='?',
+                        default=join(os.path.dirname(__file__), 'data'))
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="regenerate existing files")
+    args = parser.parse_args(argv)
+    generate(args.directory, args.scale, args.force)
+
+
+if __name__ == '__main__':
+    main()
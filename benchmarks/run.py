@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+run.py
+
+timing and memory benchmarks of the core h5nav commands
+
+Each benchmark runs its setup commands in a fresh interpreter, then times
+one command; this is repeated to get a cold-cache free minimum and a
+median. Peak memory is measured in an extra run under tracemalloc, which
+tracks numpy buffers but not the internal allocations of HDF5.
+
+Results are written to benchmarks/results/<commit>-<scale>.json; pass an
+older result file with --compare to print the ratios between both runs.
+
+Usage: python benchmarks/run.py [--scale small|full] [-r N] [-k PATTERN]
+                                [--compare OLD.json]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from fnmatch import fnmatchcase
+from os.path import abspath, dirname, isdir, join
+
+HERE = dirname(abspath(__file__))
+sys.path.insert(0, dirname(HERE))
+os.environ['H5NAV_CONFIG'] = os.devnull
+
+from generate import SCALES, generate  # noqa: E402
+import h5nav.cli as cli  # noqa: E402
+
+
+def deep_path(scale):
+    return '/'.join("level{}".format(num)
+                    for num in range(SCALES[scale]['depth']))
+
+
+def benchmarks(scale):
+    """(name, file key, setup steps, timed step)
+
+    Steps are command lines, or callables taking the interpreter.
+    """
+    def complete_wide(interp):
+        line = "cd group00"
+        interp.complete_cd("group00", line, 3, len(line))
+
+    def complete_deep(interp):
+        line = "cd " + deep_path(scale)[:-1]
+        interp.complete_cd(deep_path(scale).rsplit('/', 1)[-1][:-1],
+                           line, line.rfind('/') + 1, len(line))
+
+    deepest = deep_path(scale)
+    return [
+        ('open/wide', 'wide', [], 'open {wide}'),
+        ('ls/wide', 'wide', ['cd wide'], 'ls'),
+        ('ls/deep', 'deep', ['cd ' + deepest[:deepest.rfind('/')]], 'ls'),
+        ('cd/deep', 'deep', [], 'cd ' + deepest),
+        ('cd/wide', 'wide', ['cd wide'], 'cd group{:06d}'.format(
+            SCALES[scale]['width'] - 1)),
+        ('complete/wide', 'wide', ['cd wide'], complete_wide),
+        ('complete/wide-warm', 'wide', ['cd wide', complete_wide],
+         complete_wide),
+        ('complete/deep', 'deep', [], complete_deep),
+        ('tree/deep', 'deep', [], 'tree'),
+        ('ls-R/wide', 'wide', [], 'ls -R -l'),
+        ('find/deep', 'deep', [], 'find -name values'),
+        ('find/wide', 'wide', [], 'find -name dset00001*'),
+        ('attrs-R/deep', 'deep', [], 'attrs -R'),
+        ('where-attr/wide', 'wide', [], 'where-attr units=K'),
+        ('du/data', 'data', [], 'du'),
+        ('stats/chunked', 'data', [], 'stats chunked'),
+        ('stats/contiguous', 'data', [], 'stats contiguous'),
+        ('pdf/chunked', 'data', [], 'pdf chunked'),
+        ('where/chunked', 'data', [], 'where chunked "x > 340 | isnan(x)"'),
+        ('cat/strings', 'data', [], 'cat strings'),
+        ('head/compound', 'data', [], 'head compound'),
+        ('chunks/chunked', 'data', [], 'chunks chunked'),
+    ]
+
+
+class Quiet(object):
+    """Send stdout to a buffer, raising on error lines of h5nav"""
+    def __enter__(self):
+        self.stdout, sys.stdout = sys.stdout, io.StringIO()
+        return self
+
+    def __exit__(self, *exc):
+        out, sys.stdout = sys.stdout.getvalue(), self.stdout
+        errors = [l for l in out.splitlines() if l.startswith('*** ')]
+        if errors and exc[0] is None:
+            raise RuntimeError(errors[0])
+
+
+def run_once(files, setup, command, trace=False):
+    """Wall time (s) and peak traced memory (bytes) of one command"""
+    with Quiet():
+        interp = cli.H5NavCmd()
+        # Time the foreground work, not what a prefetch left in cache
+        interp.prefetching = False
+        if callable(command) or not command.startswith('open'):
+            interp.onecmd('open ' + files['__file__'])
+        for step in setup:
+            if callable(step):
+                step(interp)
+            else:
+                interp.onecmd(step)
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        if callable(command):
+            command(interp)
+        else:
+            interp.onecmd(command.format(**files))
+        wall = time.perf_counter() - start
+        peak = 0
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        interp.do_close()
+    return wall, peak
+
+
+def run(files, scale, repeat, pattern='*'):
+    results = {}
+    for name, key, setup, command in benchmarks(scale):
+        if not fnmatchcase(name, pattern):
+            continue
+        current = dict(files, __file__=files[key])
+        walls = sorted(run_once(current, setup, command)[0]
+                       for _ in range(repeat))
+        _, peak = run_once(current, setup, command, trace=True)
+        results[name] = {'min': walls[0], 'median': walls[len(walls) // 2],
+                         'peak': peak}
+        print("{:20} {:>10.2f} ms {:>10.2f} ms {:>10.1f} MiB".format(
+            name, 1e3 * walls[0], 1e3 * walls[len(walls) // 2],
+            peak / 2. ** 20))
+    return results
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(new, old):
+    print("\n{:20} {:>12} {:>12} {:>8}".format(
+        "benchmark", "old (ms)", "new (ms)", "ratio"))
+    for name in sorted(new):
+        if name not in old:
+            continue
+        before, after = old[name]['min'], new[name]['min']
+        print("{:20} {:>12.2f} {:>12.2f} {:>8.2f}".format(
+            name, 1e3 * before, 1e3 * after, after / before))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--data', default=join(HERE, 'data'),
+                        help="directory of the synthetic files")
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-k', dest='pattern', default='*',
+                        help="only run benchmarks matching this glob")
+    parser.add_argument('-o', '--output',
+                        help="result file "
+                        "(default: results/<commit>-<scale>.json)")
+    parser.add_argument('--compare', help="older result file")
+    args = parser.parse_args(argv)
+
+    import h5py
+    import numpy
+    files = generate(args.data, args.scale)
+    print("{:20} {:>13} {:>13} {:>14}".format(
+        "benchmark", "min", "median", "peak memory"))
+    results = run(files, args.scale, args.repeat, args.pattern)
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        maxrss = None
+    report = {
+        'commit': commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': args.scale, 'repeat': args.repeat,
+        'python': platform.python_version(), 'numpy': numpy.__version__,
+        'h5py': h5py.__version__, 'hdf5': h5py.version.hdf5_version,
+        'maxrss_kib': maxrss, 'results': results,
+    }
+    output = args.output or join(HERE, 'results',
+                                 "{}-{}.json".format(report['commit'],
+                                                     args.scale))
+    if not isdir(dirname(abspath(output))):
+        os.makedirs(dirname(abspath(output)))
+    with open(output, 'w') as fobj:
+        json.dump(report, fobj, indent=2, sort_keys=True)
+    print("results written to " + output)
+    if args.compare:
+        with open(args.compare) as fobj:
+            compare(results, json.load(fobj)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -11,9 +11,18 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import re
 import sys
 import cmd
+import json
+import time
+import shlex
+import argparse
+import itertools
+import threading
+from collections import OrderedDict
 from builtins import input
+from glob import glob
 from os.path import splitext, isfile
 from textwrap import dedent
 
@@ -21,12 +30,21 @@ from textwrap import dedent
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-import numpy as np
-from h5py import File
+from . import __version__
+from .lazy import LazyModule
 
-from pkg_resources import get_distribution
+from .index import (AttrIndex, PathTrie, TreeIndex, format_attr,
+                    make_entry, read_attrs)
+from .prefetch import Prefetcher
+from .sidecar import Sidecar, dataset_signature
+from .stream import (BLOCK_SIZE, Moments, moments, value_range, bin_edges,
+                     histogram, parallel_map, moments_task, histogram_task,
+                     selection_chunks, selection_size, chunk_sizes,
+                     block_shape, common_unit, iter_slices, read_preview,
+                     dump_npy, dump_task, dump_txt, Predicate, where)
 
-__version__ = get_distribution('h5nav').version
+np = LazyModule('numpy')
+h5py = LazyModule('h5py')
 
 
 class ExitCmd(cmd.Cmd, object):
@@ -79,7 +97,10 @@ class SmartCmd(cmd.Cmd, object):
     - function / help shortcuts (as short as disambiguation permits)
     - catch ^C
     - catch assertion errors
+    - hyphens in command names stand for underscores (where-attr)
     """
+    identchars = cmd.Cmd.identchars + '-'
+
     def cmdloop_with_keyboard_interrupt(self):
         doQuit = False
         while not doQuit:
@@ -90,6 +111,12 @@ class SmartCmd(cmd.Cmd, object):
                 self.intro = None
                 sys.stdout.write('\n')
 
+    def parseline(self, line):
+        command, arg, line = cmd.Cmd.parseline(self, line)
+        if command:
+            command = command.replace('-', '_')
+        return command, arg, line
+
     def default(self, line):
         """Override this command from cmd.Cmd to accept shortcuts"""
         cmd, arg, _ = self.parseline(line)
@@ -107,6 +134,7 @@ class SmartCmd(cmd.Cmd, object):
 
     def do_help(self, arg):
         """Wrapper for cmd.Cmd.do_help to accept shortcuts"""
+        arg = arg.replace('-', '_')
         if arg:
             helper = [n[5:] for n in self.get_names()
                       if n.startswith('help_' + arg)]
@@ -123,12 +151,76 @@ class SmartCmd(cmd.Cmd, object):
                 arg = helper[0]
         cmd.Cmd.do_help(self, arg)
 
+    timing = False
+
     def onecmd(self, line):
-        """Wrapper for cmd.Cmd.onecmd to catch assertion errors"""
+        """Wrapper for cmd.Cmd.onecmd to catch assertion errors
+
+        When `timing` is on, resource usage is reported after the command.
+        """
+        probe = None
+        if self.timing and line.strip():
+            probe = ResourceProbe(self.counters)
         try:
             cmd.Cmd.onecmd(self, line)
         except AssertionError as err:
             print("\n".join("*** " + l for l in err.args[0].split('\n')))
+        if probe is not None and self.timing:
+            print(probe.report())
+
+    def counters(self):
+        """Application counters reported by `timing`, as a dict"""
+        return {}
+
+    def do_timing(self, s):
+        """Toggle the report of resource usage after each command"""
+        if s.strip() not in ('', 'on', 'off'):
+            print("*** usage: timing [on|off]")
+            return
+        if s.strip():
+            self.timing = s.strip() == 'on'
+        print("timing is " + ('on' if self.timing else 'off'))
+
+    def complete_timing(self, text, line, begidx, endidx):
+        return [v for v in ('on', 'off') if v.startswith(text)]
+
+    def help_timing(self):
+        print(dedent("""\
+                Report resource usage after each command
+                    timing [on|off]
+                Shows wall and CPU time (including child processes), bytes
+                read (rchar of /proc/self/io, so page cache hits count),
+                datasets opened and peak resident memory during the
+                command, where the platform provides them."""))
+
+    def do_profile(self, s):
+        """Run one command under cProfile and show its hot spots"""
+        parser = CmdArgumentParser(prog='profile')
+        parser.add_argument('-n', type=int, default=20)
+        parser.add_argument('-s', '--sort', default='cumulative')
+        parser.add_argument('-o', '--output')
+        parser.add_argument('command', nargs=argparse.REMAINDER)
+        args = parser.parse_args(s.split())
+        assert args.command, "no command to profile"
+        import cProfile
+        import pstats
+        assert args.sort in pstats.Stats.sort_arg_dict_default, \
+            "unknown sort key: " + args.sort
+        profiler = cProfile.Profile()
+        profiler.runcall(self.onecmd, " ".join(args.command))
+        if args.output:
+            profiler.dump_stats(args.output)
+            print("profile written to " + args.output)
+        stats = pstats.Stats(profiler, stream=sys.stdout)
+        stats.sort_stats(args.sort).print_stats(args.n)
+
+    def help_profile(self):
+        print(dedent("""\
+                Run a command under cProfile and print its top hot spots
+                    profile [-n N] [-s SORT] [-o FILE] command [args]
+                -n: number of functions shown (default 20)
+                -s: pstats sort key: cumulative (default), tottime, calls...
+                -o: also save the raw profile, for pstats or snakeviz"""))
 
 
 class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
@@ -140,13 +232,39 @@ class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
 
     def __init__(self):
         super(H5NavCmd, self).__init__()
+        self.block_size = BLOCK_SIZE
+        self.open_options = {}
+        self.datasets_opened = 0
+        self.prefetching = True
+        # Guards the h5py file and the metadata caches shared with the
+        # prefetch thread
+        self._lock = threading.RLock()
+        self._prefetcher = Prefetcher()
+        self.configure(load_config())
         self._init()
 
+    def configure(self, config):
+        """Apply settings read from a configuration file"""
+        for key, value in config.get('h5nav', {}).items():
+            if key == 'block_size':
+                self.block_size = value
+        self.open_options = dict(config.get('open', {}))
+
     def _init(self):
         self.path = '(no file)'
         self.h5file = None
         self.position = "/"
         self.last_pos = "/"
+        self._children = {}
+        self._trie = PathTrie()
+        self._index = None
+        self._attrs = None
+        self._moments = {}
+        self._chunk_caches = {}
+        self.sidecar = None
+
+    def counters(self):
+        return OrderedDict([('datasets opened', self.datasets_opened)])
 
     @property
     def prompt(self):
@@ -182,12 +300,48 @@ class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
         pass
 
     def do_open(self, s):
-        assert len(s.split()) == 1, "invalid number of arguments"
-        assert isfile(s), "Can't access file " + s
+        parser = CmdArgumentParser(prog='open')
+        parser.add_argument('--cache', action='store_true')
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('-w', '--write', action='store_true')
+        mode.add_argument('--swmr', action='store_true')
+        parser.add_argument('--rdcc-nbytes', type=parse_size)
+        parser.add_argument('--rdcc-nslots', type=int)
+        parser.add_argument('--rdcc-w0', type=float)
+        parser.add_argument('--page-buf-size', type=parse_size)
+        parser.add_argument('--driver', choices=['core', 'sec2', 'stdio'])
+        parser.add_argument('filename')
+        args = parser.parse_args(s.split())
+        options = dict(self.open_options)
+        for key in OPEN_OPTIONS:
+            if getattr(args, key) is not None:
+                options[key] = getattr(args, key)
+        assert isfile(args.filename), "Can't access file " + args.filename
         self.do_close()
-        self.path = s
-        self.h5file = File(s, 'r+')
+        if args.cache:
+            # Checked before opening: opening for writing touches the file
+            self.sidecar = Sidecar(args.filename)
+            entries = self.sidecar.load_index()
+            if entries is not None:
+                self._index = TreeIndex(entries)
+        try:
+            if args.write:
+                h5file = h5py.File(args.filename, 'r+', **options)
+            else:
+                h5file = h5py.File(args.filename, 'r', swmr=args.swmr,
+                                   **options)
+        except (IOError, OSError, ValueError) as err:
+            if self.sidecar is not None:
+                self.sidecar.close()
+            self._init()
+            print("*** could not open {}: {}".format(args.filename, err))
+            return
+        self.path = args.filename
+        self.h5file = h5file
         self.position = '/'
+        if args.cache:
+            self.index
+        self.prefetch()
 
     def complete_open(self, text, line, begidx, endidx):
         candidates = [f for f in os.listdir('.')
@@ -195,16 +349,98 @@ class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
         return [f for f in candidates if f.startswith(text)]
 
     def help_open(self):
-        print("Load an hdf5 file")
+        print(dedent("""\
+                Load an hdf5 file: open [-w|--swmr] [--cache] filename
+                The file is opened read-only, unless:
+                    -w       open for writing (needed by rm, rechunk...)
+                    --swmr   single writer / multiple readers mode, to read
+                             a file being written (see `refresh`)
+                Tuning options (defaults can be set in the [open] section
+                of ~/.config/h5nav/config.ini, or of $H5NAV_CONFIG):
+                    --rdcc-nbytes SIZE   raw data chunk cache size (e.g. 1G)
+                    --rdcc-nslots N      chunk cache hash table slots
+                    --rdcc-w0 W          chunk cache preemption policy
+                    --driver DRIVER      core, sec2 or stdio
+                    --page-buf-size SIZE page buffer (paged files only)
+                See also `cache` for per dataset chunk caches.
+                    --cache  keep the file index and computed statistics in
+                             a sidecar database (in ~/.cache/h5nav), so
+                             that re-opening a huge file is instant
+                If the file was modified since, its index is rebuilt from a
+                full walk and statistics are computed again, except for
+                datasets which grew along their first axis: only their new
+                rows are read."""))
+
+    def check_writable(self):
+        """Fail unless the file was opened for writing"""
+        assert self.h5file.mode == 'r+', \
+            "file is open read-only, re-open it with `open -w`"
+
+    def do_refresh(self, s):
+        """Re-read dataset extents, e.g. while a simulation writes them"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        if self._index is None:
+            paths = [self.get_elem_abspath(dts) for dts in self.datasets]
+        else:
+            paths = [e.path for e in self._index.entries.values()
+                     if e.kind == 'Dataset']
+        for path in paths:
+            dset = self.h5file[path]
+            try:
+                dset.refresh()
+            except (ValueError, RuntimeError) as err:
+                print("*** could not refresh {}: {}".format(path, err))
+                return
+            if self._index is not None:
+                self._index.add(make_entry(path, dset))
+        print("--- refreshed {} datasets".format(len(paths)))
 
-    def do_close(self):
-        if self.h5file is not None:
-            self.h5file.close()
-            self._init()
+    def help_refresh(self):
+        print(dedent("""\
+                Re-read the extents of the datasets (of the whole file if
+                indexed, else of the current group) without re-opening the
+                file. Mostly useful with `open --swmr`."""))
+
+    def do_close(self, s=''):
+        self._prefetcher.cancel()
+        with self._lock:
+            if self.h5file is not None:
+                wrote = self.h5file.mode == 'r+'
+                self.h5file.close()
+                if self.sidecar is not None:
+                    # Unless this session wrote it, a file modified by
+                    # another process may not match the index in memory
+                    if self._index is not None and (
+                            wrote or self.sidecar.unchanged):
+                        self.sidecar.save_index(
+                            self._index.entries.values())
+                    self.sidecar.close()
+                self._init()
 
     def help_close(self):
         print("Close current file")
 
+    def do_blocksize(self, s):
+        """Show or set the size of the blocks read from datasets"""
+        if len(s.split()) > 1:
+            print("*** invalid number of arguments")
+            return
+        if s:
+            try:
+                self.block_size = parse_size(s)
+            except ValueError:
+                print("*** invalid size " + s)
+                return
+        print("block size: {} bytes".format(self.block_size))
+
+    def help_blocksize(self):
+        print(dedent("""\
+                Show or set the maximum size of the blocks read at once by
+                commands streaming through datasets (stats, ...).
+                Sizes accept K, M, G suffixes, e.g. `blocksize 256M`."""))
+
     def do_exit(self, s):
         """Override exit to include a close for file"""
         self.do_close()
@@ -213,61 +449,319 @@ class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
     do_quit = do_exit
     do_bye = do_exit
 
+    def children(self, path=None):
+        """Names and kinds of the members of group `path` (default: current)
+
+        The listing of a group is read once, with a single iteration over
+        its links, and cached until `invalidate` is called on it. Kinds are
+        'Group', 'Dataset', 'Datatype' or None (e.g. for broken links).
+        """
+        path = path or self.position
+        with self._lock:
+            if path not in self._children:
+                grp = self.h5file[path]
+                listing = OrderedDict()
+                for name in grp:
+                    try:
+                        kind = grp.get(name, getclass=True)
+                    except (KeyError, RuntimeError):
+                        kind = None
+                    listing[name] = getattr(kind, '__name__', None)
+                self._children[path] = listing
+            return self._children[path]
+
+    def _prefetch_group(self, path):
+        """Prefetch worker: cache the listing of `path`, return subgroups"""
+        with self._lock:
+            if self.h5file is None:
+                return []
+            listing = self.children(path)
+        return [path + name + '/' for name, kind in listing.items()
+                if kind == 'Group']
+
+    def prefetch(self):
+        """List the current group and its subgroups in the background"""
+        if self.prefetching and self.h5file is not None:
+            self._prefetcher.schedule(self._prefetch_group, self.position)
+
+    def do_prefetch(self, s):
+        """Toggle the background prefetch of group listings"""
+        if s.strip() not in ('', 'on', 'off'):
+            print("*** usage: prefetch [on|off]")
+            return
+        if s.strip():
+            self.prefetching = s.strip() == 'on'
+            if not self.prefetching:
+                self._prefetcher.cancel()
+        print("prefetch is " + ('on' if self.prefetching else 'off'))
+
+    def complete_prefetch(self, text, line, begidx, endidx):
+        return [v for v in ('on', 'off') if v.startswith(text)]
+
+    def help_prefetch(self):
+        print(dedent("""\
+                Toggle the background listing of groups (default: on)
+                    prefetch [on|off]
+                After `open` and each `cd`, a thread lists the new current
+                group and its subgroups, so that `ls` and completion do not
+                wait for the file system. Turn it off to keep all reads in
+                the foreground, e.g. to time a command."""))
+
+    @property
+    def index(self):
+        """Index of the whole file hierarchy, built on first use"""
+        if self._index is None:
+            self._index = TreeIndex.from_file(self.h5file)
+            if self.sidecar is not None:
+                self.sidecar.save_index(self._index.entries.values())
+        return self._index
+
+    def indexed_path(self, path):
+        """Path of object `path` in the file index, links resolved"""
+        indexed = self.index.resolve(self.h5file, path)
+        assert indexed is not None, path + " is not in the file index"
+        return indexed
+
+    @property
+    def attr_index(self):
+        """Index of the attributes of the whole file, built on first use
+
+        If the file index is not built yet, both are filled by the same
+        walk of the file.
+        """
+        if self._attrs is None:
+            if self._index is None:
+                entries = []
+                self._attrs = AttrIndex.from_file(self.h5file, entries)
+                self._index = TreeIndex(entries)
+                if self.sidecar is not None:
+                    self.sidecar.save_index(entries)
+            else:
+                self._attrs = AttrIndex.from_file(self.h5file)
+        return self._attrs
+
+    def invalidate(self, path):
+        """Drop cached metadata of `path`, its parent and descendants"""
+        path = '/' + path.strip('/')
+        with self._lock:
+            for cache in (self._moments, self._chunk_caches):
+                for key in list(cache):
+                    if (key + '/').startswith(path.rstrip('/') + '/'):
+                        del cache[key]
+            if path == '/':
+                self._children.clear()
+                self._trie = PathTrie()
+                self._index = None
+                self._attrs = None
+                if self.sidecar is not None:
+                    self.sidecar.drop(path)
+                return
+            if self._index is not None:
+                self._index.remove(path)
+            if self._attrs is not None:
+                self._attrs.remove(path)
+            if self.sidecar is not None:
+                self.sidecar.drop(path)
+            parent = path.rsplit('/', 1)[0] + '/'
+            for key in list(self._children):
+                if key == parent or (key + '/').startswith(path + '/'):
+                    del self._children[key]
+            self._trie.remove(path)
+
+    def complete_path(self, text, line, endidx, kinds=('Dataset',)):
+        """Completions of the path ending `line[:endidx]`
+
+        Relative, absolute and multi-level paths are completed, from a
+        trie of the group listings filled as groups are visited. Groups
+        are always offered (with a trailing '/'), so as to go down the
+        hierarchy; other members only if their kind is in `kinds`.
+        Candidates are returned relative to `text`, the part of the path
+        that readline is completing (after the last '/' by default).
+        """
+        if self.h5file is None:
+            return []
+        arg = line[:endidx].split(' ')[-1]
+        head, slash, prefix = arg.rpartition('/')
+        group = '/' if arg.startswith('/') else self.position
+        for part in head.split('/'):
+            if part in ('', '.'):
+                continue
+            if part == '..':
+                group = group.rstrip('/').rsplit('/', 1)[0] + '/'
+                continue
+            self._trie_node(group)
+            member = self._trie.lookup(group, part)
+            if member is None or member[1] != 'Group':
+                return []
+            group += member[0] + '/'
+        self._trie_node(group)
+        offset = len(arg) - len(text)
+        return [(head + slash + key + ('/' if kind == 'Group' else ''))[
+                    offset:]
+                for key, _, kind in self._trie.complete(group, prefix)
+                if kind == 'Group' or kind in kinds]
+
+    def _trie_node(self, group):
+        """Add the listing of `group` to the completion trie if missing"""
+        if group not in self._trie:
+            self._trie.add(group, self.children(group))
+
     @property
     def groups(self):
-        return [f for f in self.h5file[self.position].keys()
-                if self.h5file[self.position + f].__class__.__name__
-                   == "Group"]
+        return [f for f, kind in self.children().items() if kind == "Group"]
 
     @property
     def datasets(self):
-        return [f for f in self.h5file[self.position].keys()
-                if self.h5file[self.position + f].__class__.__name__
-                   == "Dataset"]
+        return [f for f, kind in self.children().items()
+                if kind == "Dataset"]
 
     def do_ls(self, s):
         """sh-like ls (degraded)
 
-        Supports fake globbing: either 'group_name' or '*' -> all folders
+        Supports fake globbing: either 'group_name' or '*' -> all folders,
+        and recursive listings with -R
         """
         if self.h5file is None:
             print("*** please open a file")
             return
-
-        def ls_grp(grp):
-            save = self.position[:]
-            save_last = self.last_pos[:]
-            print(grp + "/")
-            self.do_cd(grp)
-            print("    ", end='')
-            self.do_ls('')
-            self.do_cd('..')
-            self.position = save[:]
-            self.last_pos = save_last[:]
-
-        if '*' in s:
+        parser = CmdArgumentParser(prog='ls')
+        parser.add_argument('-R', '--recursive', action='store_true')
+        parser.add_argument('-L', '--depth', type=int)
+        parser.add_argument('-l', '--long', action='store_true')
+        parser.add_argument('name', nargs='?')
+        args = parser.parse_args(s.split())
+        assert args.depth is None or args.depth > 0, \
+            "depth must be positive"
+        assert args.recursive or not (args.long or args.depth), \
+            "-l and -L only apply to recursive listings (ls -R)"
+
+        if args.recursive:
+            root = self.position
+            if args.name is not None:
+                try:
+                    root = self.get_elem_abspath(args.name)
+                except UnknownLabelError:
+                    return
+            self._ls_recursive(self.indexed_path(root), args.depth,
+                               args.long)
+        elif args.name == '*':
             for grp in self.groups:
-                ls_grp(grp)
+                print(grp + "/")
+                print("    " + self.listing(self.position + grp + '/'))
             print("./")
             print("    " + " ".join(self.datasets))
-        elif s:
+        elif args.name is not None:
             try:
-                grp = self.get_whitespace_name(s)
+                path = self.get_elem_abspath(args.name)
             except UnknownLabelError:
                 return
-            ls_grp(grp)
+            if self.kind(path) != 'Group':
+                print(path.rsplit('/', 1)[-1])
+                return
+            print(path.rsplit('/', 1)[-1] + "/")
+            print("    " + self.listing(path.rstrip('/') + '/'))
         else:
-            out = [g + '/' for g in self.groups] + self.datasets
-            print(" ".join(sorted(out)))
+            print(self.listing())
+
+    def listing(self, path=None):
+        """Sorted members of group `path`, groups with a trailing '/'"""
+        out = [name + ('/' if kind == 'Group' else '')
+               for name, kind in self.children(path).items()
+               if kind in ('Group', 'Dataset')]
+        return " ".join(sorted(out))
+
+    def _ls_recursive(self, root, depth, long_format):
+        """`ls -R`: one section per group, streamed from the file index"""
+        index = self.index
+        if index[root].kind != 'Group':
+            print(root)
+            return
+        groups = [(0, index[root], True)]
+        groups = itertools.chain(groups, (
+            item for item in index.walk(root, depth)
+            if item[1].kind == 'Group'))
+        for num, (_, grp, _) in enumerate(groups):
+            if num:
+                print()
+            print(grp.path + ":")
+            members = [index[path] for path in index.members(grp.path)]
+            if long_format:
+                for entry in members:
+                    print(format_entry(entry))
+            elif members:
+                print(" ".join(entry_name(entry) for entry in members))
 
     def help_ls(self):
-        print("List current group contents. Supports `ls *`")
+        print(dedent("""\
+                List current group contents
+                    ls [group]      list a group
+                    ls *            list the current group and its subgroups
+                    ls -R [-L DEPTH] [-l] [group]
+                                    list all groups below, down to DEPTH
+                                    levels; -l adds size, shape and dtype
+                Recursive listings use the index of the file (see find),
+                where each object appears once: soft links and further hard
+                links to an object are not listed, and a group reached
+                through them is listed under its indexed path."""))
+
+    def do_tree(self, s):
+        """Draw the hierarchy below a group, from the file index"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='tree')
+        parser.add_argument('-L', '--depth', type=int)
+        parser.add_argument('-d', '--groups', action='store_true')
+        parser.add_argument('name', nargs='?')
+        args = parser.parse_args(s.split())
+        assert args.depth is None or args.depth > 0, \
+            "depth must be positive"
+        root = self.position
+        if args.name is not None:
+            try:
+                root = self.get_elem_abspath(args.name)
+            except UnknownLabelError:
+                return
+        root = '/' + root.strip('/')
+        indexed = self.indexed_path(root)
+        assert self.index[indexed].kind == 'Group', root + " is not a group"
+        print(root)
+        counts = {'Group': 0, 'Dataset': 0}
+        # pipes[n] tells whether level n + 1 still has members to draw
+        pipes = []
+        for level, entry, last in self.index.walk(indexed, args.depth):
+            if args.groups and entry.kind != 'Group':
+                continue
+            del pipes[level - 1:]
+            line = "".join("|   " if pipe else "    " for pipe in pipes)
+            line += ("`-- " if last else "|-- ") + entry_name(entry)
+            if entry.kind == 'Dataset':
+                line += "  {0} {1} {2}".format(
+                    format_shape(entry.shape), entry.dtype,
+                    human_size(entry.nbytes))
+            print(line)
+            pipes.append(not last)
+            counts[entry.kind] = counts.get(entry.kind, 0) + 1
+        print("\n{0} groups, {1} datasets".format(counts['Group'],
+                                                  counts['Dataset']))
+
+    def complete_tree(self, text, line, begidx, endidx):
+        return self.complete_path(text, line, endidx, kinds=())
+
+    def help_tree(self):
+        print(dedent("""\
+                Draw the hierarchy below a group (default: current)
+                    tree [-L DEPTH] [-d] [group]
+                -L limits the depth, -d only shows groups. Datasets are
+                shown with their shape, dtype and logical size. The walk
+                uses the index of the file (see find): soft links and
+                further hard links to an object are not drawn."""))
 
     def do_cd(self, s):
         """sh-like cd (degraded)
 
         Supports cd -, cd ..(/.. etc), no arg (back to root)
-        and of course cd group
+        and of course cd group, cd group/subgroup or cd /absolute/group
         """
         if self.h5file is None:
             print("*** please open a file")
@@ -282,198 +776,1036 @@ class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
             tmp = self.last_pos[:]
             self.last_pos = self.position[:]
             self.position = tmp[:]
-        elif s[:2] == '..':
+        elif s.strip('./') == '':
+            parts = [p for p in self.position.split('/') if p]
+            if s.startswith('/'):
+                parts = []
             nb_up = s.count('..')
-            pos = self.position.strip('/').split('/')
-            if nb_up >= len(pos):
-                self.last_pos = self.position[:]
-                self.position = '/'
-            else:
-                self.last_pos = self.position[:]
-                self.position = '/' + '/'.join(pos[:len(pos) - nb_up]) + '/'
+            self.last_pos = self.position[:]
+            self.position = '/' + ''.join(
+                p + '/' for p in parts[:max(len(parts) - nb_up, 0)])
         else:
             try:
-                pos = self.get_whitespace_name(s).strip('/')
+                path = self.get_elem_abspath(s)
             except UnknownLabelError:
                 return
-            if pos not in self.groups:
+            if self.kind(path) != 'Group':
                 print("*** can only cd into groups")
                 return
-            self.position += pos + '/'
             self.last_pos = self.position[:]
+            self.position = path.rstrip('/') + '/'
+        self.prefetch()
 
     def complete_cd(self, text, line, begidx, endidx):
-        return [f for f in self.groups if f.startswith(text)]
+        return self.complete_path(text, line, endidx, kinds=())
 
     def help_cd(self):
         print("Enter group. Also ok: `cd ..` (up), `cd -` (last), `cd` (root)")
 
     def do_cat(self, s):
-        """Print a dataset on screen"""
+        """Print a dataset on screen
+
+        Supports numpy-like selections, e.g. `cat T[0:10, ::4]`. Only the
+        elements actually printed are read from the file.
+        """
         if self.h5file is None:
             print("*** please open a file")
             return
+        s, sel = pop_selection(s)
         if len(s.split()) != 1:
             print("*** invalid number of arguments")
             return
         if s == '*':
             for dts in self.datasets:
                 print(dts + ' :')
-                print('    ', self.get_elem(dts)[()])
+                print('    ', self.format_data(self.get_elem(dts)))
         else:
             try:
-                print(self.get_elem(s)[()])
+                dset = self.get_elem(s)
             except UnknownLabelError:
                 return
+            self.print_data(dset, sel or ())
 
     def complete_cat(self, text, line, begidx, endidx):
-        return [f for f in [s.strip() for s in self.datasets]
-                if f.startswith(text)]
+        return self.complete_path(text, line, endidx)
 
     def help_cat(self):
-        print("Print dataset to screen")
+        print(dedent("""\
+                Print dataset to screen. Selections are accepted:
+                    cat T[0:10, ::4]
+                Large datasets are previewed: only the first and last items
+                of each axis are read and printed."""))
 
-    def do_stats(self, s):
-        """Print statistics for dataset on screen"""
+    def do_head(self, s):
+        """Print the first items of a dataset (along its first axis)"""
+        self._head_tail(s, 'head')
+
+    def complete_head(self, text, line, begidx, endidx):
+        return self.complete_path(text, line, endidx)
+
+    def help_head(self):
+        print("Print the first items of a dataset: head [-n N] name")
+
+    def do_tail(self, s):
+        """Print the last items of a dataset (along its first axis)"""
+        self._head_tail(s, 'tail')
+
+    def complete_tail(self, text, line, begidx, endidx):
+        return self.complete_path(text, line, endidx)
+
+    def help_tail(self):
+        print("Print the last items of a dataset: tail [-n N] name")
+
+    def _head_tail(self, s, prog):
         if self.h5file is None:
             print("*** please open a file")
             return
-        if len(s.split()) != 1:
-            print("*** invalid number of arguments")
+        parser = CmdArgumentParser(prog=prog)
+        parser.add_argument('-n', type=int, default=10)
+        parser.add_argument('name')
+        args = parser.parse_args(s.split())
+        assert args.n >= 0, "number of items must be positive"
+        try:
+            dset = self.get_elem(args.name)
+        except UnknownLabelError:
             return
+        assert dset.__class__.__name__ == "Dataset", \
+            args.name + " is not a dataset"
+        assert dset.shape, "scalar dataset has no items"
+        length = dset.shape[0]
+        if prog == 'head':
+            sel = (slice(0, min(args.n, length)),)
+        else:
+            sel = (slice(max(length - args.n, 0), length),)
+        self.print_data(dset, sel)
+
+    def format_data(self, dset, sel=()):
+        """String of the selection of a dataset, as printed by numpy
+
+        Big selections are summarized by numpy: only the printed elements
+        are read (see `read_preview`).
+        """
+        data, summarized = read_preview(dset, sel)
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        if summarized:
+            return np.array2string(data, threshold=0)
+        return str(data)
+
+    def print_data(self, dset, sel=()):
+        if dset.__class__.__name__ != "Dataset":
+            print("*** not a dataset")
+            return
+        try:
+            print(self.format_data(dset, sel))
+        except (ValueError, IndexError, TypeError) as err:
+            print("*** invalid selection: " + str(err))
+
+    def do_stats(self, s):
+        """Print statistics for dataset on screen
+
+        Datasets are streamed block by block (see `blocksize`), so that
+        memory stays bounded whatever the dataset size. With `-j`, the
+        datasets of `stats *` are reduced by a pool of processes.
+        """
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='stats')
+        parser.add_argument('-j', '--jobs', type=int, default=1)
+        parser.add_argument('name')
+        args = parser.parse_args(s.split())
 
         header = "Type           mean +/- std*2       [        min, max        ] (Shape)"
         header += '\n' + '-' * (len(header) + 4)
 
-        def print_stats(nparr):
-            try:
-                mini = nparr.min()
-                mean = nparr.mean()
-                maxi = nparr.max()
-                std = nparr.std()
-            except:
-                mini, mean, maxi, std = ["Undef"]*4
-            print("{0} {1: 5.4e} +/- {2: 5.4e} [{3: 5.4e}, {4: 5.4e}] {5}".format(
-                        nparr.dtype, mean, std*2, mini, maxi, nparr.shape))
+        def get_stats(dset):
+            if self.h5file.swmr_mode:
+                dset.refresh()
+            mom, start = self.resume_stats(dset)
+            if start is not None:
+                try:
+                    new = moments(dset, self.block_size, start)
+                except (TypeError, ValueError) as err:
+                    return err
+                mom = new if mom is None else mom.merge(new)
+                self.store_stats(dset, mom)
+            return mom
+
+        def print_stats(dset, mom, prefix=""):
+            if isinstance(mom, Exception) and \
+                    not isinstance(mom, TypeError):
+                print(prefix + "*** " + str(mom))
+            elif isinstance(mom, Exception) or mom.count == 0:
+                print("{0}{1} {2} +/- {2} [{2}, {2}] {3}".format(
+                        prefix, dset.dtype, "Undef", dset.shape))
+            else:
+                print("{0}{1} {2: 5.4e} +/- {3: 5.4e} [{4: 5.4e}, {5: 5.4e}]"
+                      " {6}".format(prefix, dset.dtype, mom.mean, mom.std*2,
+                                    mom.min, mom.max, dset.shape))
 
-        if s == '*':
+        if args.name == '*':
             print("    " + header)
-            for dts in self.datasets:
+            names = self.datasets
+            if args.jobs > 1:
+                self.h5file.flush()
+                known = [self.resume_stats(self.get_elem(dts))
+                         for dts in names]
+                computed = parallel_map(
+                    moments_task,
+                    [(self.h5file.filename, self.get_elem_abspath(dts),
+                      self.block_size, self.h5file.swmr_mode)
+                     for dts, (mom, _) in zip(names, known) if mom is None],
+                    args.jobs)
+
+                def collect(dts, known):
+                    mom, start = known
+                    if mom is None:
+                        mom = next(computed)
+                        self.store_stats(self.get_elem(dts), mom)
+                    elif start is not None:
+                        mom = get_stats(self.get_elem(dts))
+                    return mom
+                results = (collect(dts, k) for dts, k in zip(names, known))
+            else:
+                results = (get_stats(self.get_elem(dts)) for dts in names)
+            for dts, mom in zip(names, results):
                 print(dts + ' :')
-                print('    ', end='')
-                print_stats(self.get_elem(dts)[()])
+                print_stats(self.get_elem(dts), mom, prefix="    ")
         else:
             try:
-                nparr = self.get_elem(s)[()]
+                dset = self.get_elem(args.name)
             except UnknownLabelError:
                 return
             print(header)
-            print_stats(nparr)
+            print_stats(dset, get_stats(dset))
+
+    def resume_stats(self, dset):
+        """Known moments of `dset`, and the first row they do not cover
+
+        Returns (Moments, None) if moments are up to date, and (None, 0)
+        if nothing is known. Datasets resizable along their first axis are
+        assumed to be append-only: their moments are kept with the shape
+        they covered, so that only appended rows need to be read.
+        """
+        if self.sidecar is not None:
+            mom = self.sidecar.get_stats(dset.name, dataset_signature(dset))
+            if mom is not None:
+                return mom, None
+        state = self._moments.get(dset.name)
+        stored = False
+        if state is None and self.sidecar is not None:
+            last = self.sidecar.last_stats(dset.name)
+            if last is not None and last[1] == str(dset.dtype):
+                state, stored = (last[0], last[2]), True
+        if state is None or not dset.shape:
+            return None, 0
+        shape, mom = state
+        maxrows = dset.maxshape[0]
+        if maxrows is not None and maxrows <= shape[0]:
+            return None, 0
+        if shape[1:] != dset.shape[1:] or shape[0] > dset.shape[0]:
+            return None, 0
+        if shape[0] == dset.shape[0]:
+            # Stored moments failed their signature check: the data may
+            # have been rewritten in place
+            return (None, 0) if stored else (mom, None)
+        return mom, shape[0]
+
+    def store_stats(self, dset, mom):
+        """Keep moments of `dset`, in the sidecar cache if any"""
+        if not isinstance(mom, Moments):
+            return
+        self._moments[dset.name] = (dset.shape, mom)
+        if self.sidecar is not None:
+            self.sidecar.put_stats(dset.name, dataset_signature(dset), mom)
 
     def complete_stats(self, text, line, begidx, endidx):
-        return [f for f in [s.strip() for s in self.datasets]
-                if f.startswith(text)]
+        return self.complete_path(text, line, endidx)
 
     def help_stats(self):
         print("Get general statistics of dataset. +/- is 95% confidence"
               " interval (2 standard deviations).")
+        print("Use `stats -j N *` to process all datasets with N processes.")
+        print("Datasets resizable along their first axis are considered "
+              "append-only: on\nrepeated calls, only new rows are read.")
 
     def do_pdf(self, s):
-        """Print pdf for dataset on screen"""
+        """Print pdf for dataset on screen
+
+        The histogram is accumulated block by block: a first pass finds
+        the range (unless given), a second one counts values in the bins.
+        With `-j`, the datasets of `pdf *` are processed in parallel.
+        """
         if self.h5file is None:
             print("*** please open a file")
             return
-        if len(s.split()) != 1:
-            print("*** invalid number of arguments")
-            return
-
-        def print_pdf(nparr, prefix=""):
+        parser = CmdArgumentParser(prog='pdf')
+        parser.add_argument('-b', '--bins', type=int, default=10)
+        parser.add_argument('-r', '--range', type=float, nargs=2)
+        parser.add_argument('-l', '--log', action='store_true')
+        parser.add_argument('-j', '--jobs', type=int, default=1)
+        parser.add_argument('name')
+        args = parser.parse_args(s.split())
+        assert args.bins > 0, "number of bins must be positive"
+
+        def get_pdf(dset):
             try:
-                print("{0}{1: 5.4e} {2: 5.4e} | ".format(prefix, nparr.min(), nparr.max()),
+                if args.range is None:
+                    lo, hi = value_range(dset, self.block_size, args.log)
+                else:
+                    lo, hi = args.range
+                if lo is None:
+                    return lo, hi, None
+                edges = bin_edges(lo, hi, args.bins, args.log)
+                return lo, hi, histogram(dset, edges, self.block_size)
+            except (TypeError, ValueError) as err:
+                return err
+
+        def print_pdf(result, prefix=""):
+            if isinstance(result, TypeError):
+                print(prefix + "PDF does not apply: " + str(result))
+            elif isinstance(result, Exception):
+                print(prefix + "*** " + str(result))
+            elif result[2] is None:
+                print(prefix + "No valid value. PDF does not apply")
+            else:
+                lo, hi, counts = result
+                print("{0}{1: 5.4e} {2: 5.4e} | ".format(prefix, lo, hi),
                       end='')
-                print(np.histogram(nparr)[0].tolist())
-            except:
-                print("String type. PDF does not apply")
+                print(counts.tolist())
 
-        header = "Min         Max         | Pdf (10 buckets)"
+        header = "Min         Max         | Pdf ({0} {1}buckets)".format(
+            args.bins, "log " if args.log else "")
         header += '\n' + '-' * (len(header) + 4)
 
-        if s == '*':
+        if args.name == '*':
             print("    " + header)
-            for dts in self.datasets:
+            names = self.datasets
+            if args.jobs > 1:
+                self.h5file.flush()
+                results = parallel_map(
+                    histogram_task,
+                    [(self.h5file.filename, self.get_elem_abspath(dts),
+                      self.block_size, args.bins, args.range, args.log,
+                      self.h5file.swmr_mode)
+                     for dts in names],
+                    args.jobs)
+            else:
+                results = (get_pdf(self.get_elem(dts)) for dts in names)
+            for dts, result in zip(names, results):
                 print(dts + ' :')
-                dts = self.get_elem(dts)[()]
-                print_pdf(dts, prefix="    ")
+                print_pdf(result, prefix="    ")
         else:
             try:
-                nparr = self.get_elem(s)[()]
+                dset = self.get_elem(args.name)
             except UnknownLabelError:
                 return
             print(header)
-            print_pdf(nparr)
+            print_pdf(get_pdf(dset))
 
     def complete_pdf(self, text, line, begidx, endidx):
-        return [f for f in [s.strip() for s in self.datasets]
-                if f.startswith(text)]
+        return self.complete_path(text, line, endidx)
 
     def help_pdf(self):
-        print("Get pdf of dataset")
+        print(dedent("""\
+                Get pdf of dataset: pdf [-b BINS] [-r MIN MAX] [-l] name
+                    -b, --bins   number of buckets (default 10)
+                    -r, --range  histogram range (default: data min, max)
+                    -l, --log    logarithmic buckets (positive values only)
+                    -j, --jobs   with `pdf *`, number of worker processes
+                Datasets are read block by block, whatever their size."""))
 
     def do_dump(self, s):
-        """Dump dataset in numpy binary format"""
+        """Dump dataset in numpy binary format
+
+        Datasets are copied block by block into a memory mapped .npy file.
+        With `dump -j N *`, N datasets are written in parallel.
+        """
         if self.h5file is None:
             print("*** please open a file")
             return
-        if len(s.split()) != 1:
-            print("*** invalid number of arguments")
-            return
-        if s == '*':
-            for dts in self.datasets:
-                dts = self.get_elem(dts)[()]
-                np.save(s, dts)
-                print("--- file saved to {}.npy".format(s))
+        parser = CmdArgumentParser(prog='dump')
+        parser.add_argument('-j', '--jobs', type=int, default=1)
+        parser.add_argument('name')
+        args = parser.parse_args(s.split())
+        if args.name == '*':
+            names = self.datasets
+            fnames = [dts.strip() + '.npy' for dts in names]
+            if args.jobs > 1:
+                self.h5file.flush()
+                results = parallel_map(
+                    dump_task,
+                    [(self.h5file.filename, self.get_elem_abspath(dts),
+                      fname, self.block_size, self.h5file.swmr_mode)
+                     for dts, fname in zip(names, fnames)],
+                    args.jobs)
+            else:
+                results = (self._dump(dts, fname)
+                           for dts, fname in zip(names, fnames))
+            for fname, result in zip(fnames, results):
+                if isinstance(result, Exception):
+                    print("*** could not save {}: {}".format(fname, result))
+                else:
+                    print("--- file saved to {}".format(fname))
         else:
             try:
-                nparr = self.get_elem(s)[()]
+                dset = self.get_elem(args.name)
             except UnknownLabelError:
                 return
-            np.save(s, nparr)
-            print("--- file saved to {}.npy".format(s))
+            fname = basename(dset.name) + '.npy'
+            result = self._dump(args.name, fname)
+            if isinstance(result, Exception):
+                print("*** could not save {}: {}".format(fname, result))
+                return
+            print("--- file saved to {}".format(fname))
+
+    def _dump(self, name, fname):
+        try:
+            dump_npy(self.get_elem(name), fname, self.block_size)
+        except (TypeError, ValueError, IOError) as err:
+            return err
+        return fname
 
     def complete_dump(self, text, line, begidx, endidx):
-        return [f for f in [s.strip() for s in self.datasets]
-                if f.startswith(text)]
+        return self.complete_path(text, line, endidx)
 
     def help_dump(self):
-        print("Dump dataset to numpy binary")
+        print(dedent("""\
+                Dump dataset to numpy binary: dump [-j N] name
+                `dump *` writes each dataset of the group to <name>.npy,
+                with N parallel writers if -j is given."""))
 
     def do_txt_dump(self, s):
-        """Dump dataset in txt format"""
+        """Dump dataset in txt format, block of rows by block of rows"""
         if self.h5file is None:
             print("*** please open a file")
             return
-        if len(s.split()) != 1:
-            print("*** invalid number of arguments")
-            return
-        if s == '*':
+        parser = CmdArgumentParser(prog='txt_dump')
+        parser.add_argument('-d', '--delimiter', default=' ')
+        parser.add_argument('-p', '--precision', type=int)
+        parser.add_argument('--header', action='store_true')
+        parser.add_argument('name')
+        args = parser.parse_args(s.split())
+        delimiter = {'tab': '\t', 'comma': ','}.get(args.delimiter,
+                                                     args.delimiter)
+        fmt = '%.18e' if args.precision is None \
+            else '%.{}e'.format(args.precision)
+
+        def txt_dump(name, fname):
+            dset = self.get_elem(name)
+            header = None
+            if args.header:
+                columns = [basename(dset.name)]
+                if len(dset.shape) > 1:
+                    columns = ["{}{}".format(columns[0], list(index))
+                               for index in np.ndindex(*dset.shape[1:])]
+                header = delimiter.join(columns)
+            start = time.time()
+            try:
+                nbytes = dump_txt(dset, fname, fmt, delimiter, header,
+                                  self.block_size)
+            except (TypeError, IOError) as err:
+                print("*** could not save {}: {}".format(fname, err))
+                return
+            elapsed = max(time.time() - start, 1e-6)
+            print("--- file saved to {0} ({1}, {2:.1f} MB/s)".format(
+                fname, human_size(nbytes), nbytes / elapsed / 1024 ** 2))
+
+        if args.name == '*':
             for dts in self.datasets:
-                dts = self.get_elem(dts)[()]
-                np.savetxt(s+'.txt', dts)
-                print("--- file saved to {}.txt".format(s))
+                txt_dump(dts, dts.strip() + '.txt')
         else:
             try:
-                nparr = self.get_elem(s)[()]
+                dset = self.get_elem(args.name)
             except UnknownLabelError:
                 return
-            np.savetxt(s + '.txt', nparr)
-            print("--- file saved to {}.txt".format(s))
+            txt_dump(args.name, basename(dset.name) + '.txt')
 
     def complete_txt_dump(self, text, line, begidx, endidx):
-        return [f for f in [s.strip() for s in self.datasets]
-                if f.startswith(text)]
+        return self.complete_path(text, line, endidx)
 
     def help_txt_dump(self):
-        print("Dump dataset to txt file")
+        print(dedent("""\
+                Dump dataset to txt file, like numpy.savetxt
+                    txt_dump [-d DELIMITER] [-p PRECISION] [--header] name
+                -d accepts `tab` and `comma` as aliases. --header writes a
+                first line with column names (e.g. for CSV files).
+                `txt_dump *` writes each dataset to <name>.txt."""))
+
+    def do_find(self, s):
+        """Search the file hierarchy, using the index of the file"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='find')
+        parser.add_argument('path', nargs='?')
+        parser.add_argument('-name')
+        parser.add_argument('-path', dest='glob')
+        parser.add_argument('-regex')
+        parser.add_argument('-type', choices=['d', 'f'])
+        parser.add_argument('-dtype')
+        parser.add_argument('-shape')
+        parser.add_argument('-size')
+        args = parser.parse_args(s.split())
+
+        root = self.position
+        if args.path is not None:
+            try:
+                root = self.get_elem_abspath(args.path)
+            except UnknownLabelError:
+                return
+        kind = {'d': 'Group', 'f': 'Dataset', None: None}[args.type]
+        shape = size = None
+        try:
+            if args.shape is not None:
+                shape = tuple(None if n in ('', '*') else int(n)
+                              for n in args.shape.strip('()').split(','))
+            if args.size is not None:
+                operator = {'+': '>', '-': '<'}.get(args.size[0], '=')
+                size = (operator, parse_size(args.size.lstrip('+-')))
+        except ValueError as err:
+            print("*** invalid predicate: " + str(err))
+            return
+        for entry in self.index.find(root, args.name, args.glob, args.regex,
+                                     kind, args.dtype, shape, size):
+            print(entry.path + ('/' if entry.kind == 'Group' else ''))
+
+    def help_find(self):
+        print(dedent("""\
+                Find groups and datasets below a group (default: current)
+                    find [group] [-name GLOB] [-path GLOB] [-regex RE]
+                         [-type d|f] [-dtype DTYPE] [-shape N,*,M]
+                         [-size [+-]SIZE]
+                -type d is for groups, f for datasets. -dtype accepts a
+                prefix (e.g. float). -size +1M means more than 1M bytes.
+                The file index is built on first use, then queries do not
+                read the file anymore."""))
+
+    def do_attrs(self, s):
+        """Show the attributes of an object, or of all objects below it"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='attrs')
+        parser.add_argument('-R', '--recursive', action='store_true')
+        parser.add_argument('name', nargs='?')
+        args = parser.parse_args(s.split())
+        path = self.position
+        if args.name is not None:
+            try:
+                path = self.get_elem_abspath(args.name)
+            except UnknownLabelError:
+                return
+        path = '/' + path.strip('/')
+        if not args.recursive:
+            for key, value in read_attrs(self.h5file[path]).items():
+                print("{0} = {1}".format(key, format_attr(value)))
+            return
+        for num, obj in enumerate(self.attr_index.under(path)):
+            if num:
+                print()
+            print(obj + ":")
+            for key, value in self.attr_index.get(obj).items():
+                print("    {0} = {1}".format(key, format_attr(value)))
+
+    def complete_attrs(self, text, line, begidx, endidx):
+        return self.complete_path(text, line, endidx,
+                                  kinds=('Dataset', 'Datatype'))
+
+    def help_attrs(self):
+        print(dedent("""\
+                Show attributes (default: of the current group)
+                    attrs [-R] [path]
+                With -R, the attributes of all objects below path are shown,
+                from an index of the attributes of the whole file, read in
+                a single walk on first use."""))
+
+    def do_where_attr(self, s):
+        """Find objects by attribute, using the attribute index"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='where-attr')
+        parser.add_argument('query')
+        parser.add_argument('path', nargs='?')
+        parser.add_argument('-type', choices=['d', 'f'])
+        args = parser.parse_args(s.split())
+        key, equal, value = args.query.partition('=')
+        root = self.position
+        if args.path is not None:
+            try:
+                root = self.get_elem_abspath(args.path)
+            except UnknownLabelError:
+                return
+        kind = {'d': 'Group', 'f': 'Dataset', None: None}[args.type]
+        index = self.attr_index
+        for path in index.find(key, value if equal else None, root):
+            if kind is not None and self.index[path].kind != kind:
+                continue
+            print("{0}  {1} = {2}".format(
+                path, key, format_attr(index.get(path)[key])))
+
+    def help_where_attr(self):
+        print(dedent("""\
+                Find objects below a group (default: current) by attribute
+                    where-attr key[=value] [group] [-type d|f]
+                Numbers are compared as numbers (dt=1e-3 matches 0.001),
+                other values as globs on their text (units=K*). Without a
+                value, all objects having the attribute are listed. Also
+                spelled where_attr."""))
+
+    def do_where(self, s):
+        """Count, locate or mask the items of a dataset matching a condition
+
+        The condition is evaluated block by block (see `blocksize`), so
+        memory stays bounded, and so is the mask written with --mask.
+        """
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='where')
+        parser.add_argument('-n', type=int, default=0)
+        parser.add_argument('--bbox', action='store_true')
+        parser.add_argument('--mask')
+        parser.add_argument('name')
+        parser.add_argument('expr')
+        try:
+            args = parser.parse_args(shlex.split(s))
+        except ValueError as err:
+            print("*** " + str(err))
+            return
+        try:
+            dset = self.get_elem(args.name)
+        except UnknownLabelError:
+            return
+        assert dset.__class__.__name__ == "Dataset", \
+            args.name + " is not a dataset"
+        try:
+            predicate = Predicate(args.expr)
+            predicate(np.zeros(1, dtype=dset.dtype))
+        except (ValueError, TypeError) as err:
+            print("*** " + str(err))
+            return
+
+        out = None
+        if args.mask is not None:
+            self.check_writable()
+            path = args.mask if args.mask.startswith('/') else \
+                dset.parent.name.rstrip('/') + '/' + args.mask
+            assert path not in self.h5file, path + " already exists"
+            out = self.h5file.create_dataset(path, shape=dset.shape,
+                                             dtype=bool, chunks=dset.chunks)
+        try:
+            count, indices, box = where(dset, predicate, self.block_size,
+                                        args.n, args.bbox, out)
+        except BaseException as err:
+            if out is not None:
+                del self.h5file[path]
+            if isinstance(err, (ValueError, TypeError)):
+                print("*** " + str(err))
+                return
+            raise
+        total = dset.size or 1
+        print("{0}: {1} of {2} items ({3:.3g}%)".format(
+            dset.name, count, dset.size, 100. * count / total))
+        for index in indices:
+            print("    " + str(tuple(index)))
+        if args.bbox:
+            box = "empty" if box is None else "[{}]".format(
+                ", ".join("{}:{}".format(*axis) for axis in box))
+            print("bounding box: " + box)
+        if out is not None:
+            self.invalidate(path)
+            if self._index is not None:
+                self._index.add(make_entry(path, out))
+            print("--- mask written to " + path)
+
+    def complete_where(self, text, line, begidx, endidx):
+        return self.complete_path(text, line, endidx)
+
+    def help_where(self):
+        print(dedent("""\
+                Count the items of a dataset matching a condition on x
+                    where [-n N] [--bbox] [--mask NAME] dataset "condition"
+                e.g. where T "x > 3000 | isnan(x)"
+                -n prints the indices of the first N matches, --bbox their
+                bounding box. --mask writes the boolean mask to a new
+                dataset (next to the dataset unless NAME is absolute; needs
+                `open -w`). The condition accepts numbers, x (or the field
+                names of compound datasets), nan, inf, pi, e, arithmetic,
+                comparisons (also chained: 0 < x < 1), | & ~ (or, and,
+                not) and the functions abs sqrt exp log log10 sin cos tan
+                floor ceil sign real imag isnan isinf isfinite. The dataset
+                is read block by block (see `blocksize`)."""))
+
+    def do_du(self, s):
+        """Storage accounting of groups and datasets (metadata only)"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='du')
+        parser.add_argument('path', nargs='?')
+        parser.add_argument('-h', '--human', action='store_true')
+        parser.add_argument('-d', '--depth', type=int)
+        parser.add_argument('-s', '--sort',
+                            choices=['name', 'disk', 'logical', 'ratio'],
+                            default='name')
+        args = parser.parse_args(s.split())
+
+        root = self.position
+        if args.path is not None:
+            try:
+                root = self.get_elem_abspath(args.path)
+            except UnknownLabelError:
+                return
+        root = self.indexed_path(root)
+        if self.index[root].kind != 'Group':
+            paths = [root]
+        else:
+            paths = [root] + self.index.under(root)
+        sizes = dict((path, [0, 0]) for path in paths)
+        for path in paths:
+            entry = self.index[path]
+            if entry.kind != 'Dataset':
+                continue
+            disk = self.h5file[path].id.get_storage_size()
+            parent = path
+            while True:
+                sizes[parent][0] += entry.nbytes
+                sizes[parent][1] += disk
+                if parent == root:
+                    break
+                parent = parent.rsplit('/', 1)[0] or '/'
+
+        def depth(path):
+            return len(path[len(root):].strip('/').split('/')) \
+                if path != root else 0
+
+        def ratio(path):
+            logical, disk = sizes[path]
+            return logical / float(disk) if disk else float('inf')
+
+        rows = [p for p in paths
+                if args.depth is None or depth(p) <= args.depth]
+        rows.sort(key=lambda p: p.split('/'))
+        if args.sort != 'name':
+            rows.sort(key={'logical': lambda p: sizes[p][0],
+                           'disk': lambda p: sizes[p][1],
+                           'ratio': ratio}[args.sort], reverse=True)
+        fmt = human_size if args.human else str
+        print("{0:>12} {1:>12} {2:>7}  {3}".format(
+            "On disk", "Logical", "Ratio", "Path"))
+        for path in rows:
+            logical, disk = sizes[path]
+            suffix = '/' if self.index[path].kind == 'Group' else ''
+            print("{0:>12} {1:>12} {2:>7}  {3}".format(
+                fmt(disk), fmt(logical),
+                "{:.2f}".format(ratio(path)) if disk else "-",
+                path.rstrip('/') + suffix))
+        if root == '/':
+            file_size = os.path.getsize(self.h5file.filename)
+            free = self.h5file.id.get_freespace()
+            print("File size {0}, raw data {1}, free space {2}, "
+                  "metadata and untracked {3}".format(
+                      *[fmt(n) for n in (file_size, sizes[root][1], free,
+                                         file_size - sizes[root][1] - free)]))
+
+    def help_du(self):
+        print(dedent("""\
+                Disk usage of groups and datasets (default: current group)
+                    du [-h] [-d DEPTH] [-s name|disk|logical|ratio] [path]
+                Shows on disk vs logical (uncompressed) sizes, and their
+                ratio. For the whole file, also reports the free space left
+                by deleted objects (reclaimed by h5repack). Free space is
+                only tracked by HDF5 while the file is open, unless the
+                file was created with a persistent free space strategy.
+                Only metadata is read, never data. Objects are counted once,
+                under their path in the index of the file (see ls -R)."""))
+
+    def do_chunks(self, s):
+        """Storage layout of a dataset and cost of reading parts of it"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        s, sel = pop_selection(s)
+        parser = CmdArgumentParser(prog='chunks')
+        parser.add_argument('-a', '--axis', type=int)
+        parser.add_argument('name')
+        args = parser.parse_args(s.split())
+        try:
+            dset = self.get_elem(args.name)
+        except UnknownLabelError:
+            return
+        assert dset.__class__.__name__ == "Dataset", \
+            args.name + " is not a dataset"
+        layout = make_entry(dset.name, dset).layout
+        print("{0}: {1} {2}, {3} layout".format(
+            dset.name, dset.dtype, dset.shape, layout))
+        plist = dset.id.get_create_plist()
+        filters = []
+        for i in range(plist.get_nfilters()):
+            code, flags, values, name = plist.get_filter(i)
+            name = name.decode('ascii', 'replace') \
+                if isinstance(name, bytes) else name
+            filters.append(name + (str(tuple(values)) if values else ''))
+        print("  filters       " + (", ".join(filters) or "none"))
+        print("  storage       {0} on disk for {1} logical".format(
+            human_size(dset.id.get_storage_size()),
+            human_size(dset.size * dset.dtype.itemsize)))
+        if dset.chunks is None:
+            return
+
+        chunk_bytes = int(np.prod(dset.chunks)) * dset.dtype.itemsize
+        total = selection_chunks(dset.shape, dset.chunks, ())
+        sizes = chunk_sizes(dset)
+        nslots, cache_bytes, w0 = dset.id.get_access_plist().get_chunk_cache()
+        print("  chunk shape   {0} ({1} uncompressed)".format(
+            dset.chunks, human_size(chunk_bytes)))
+        print("  chunks        {0} allocated / {1}".format(
+            dset.id.get_num_chunks(), total))
+        if len(sizes):
+            print("  chunk sizes   min {0}, median {1}, mean {2}, max {3}"
+                  .format(*[human_size(n) for n in (
+                      sizes.min(), np.median(sizes), sizes.mean(),
+                      sizes.max())]))
+        stored = sizes.mean() if len(sizes) else chunk_bytes
+        print("  chunk cache   {0} ({1} slots)".format(
+            human_size(cache_bytes), nslots))
+        if chunk_bytes > cache_bytes:
+            print("  WARNING: chunks do not fit in the chunk cache, every"
+                  " read decompresses them again")
+
+        if sel is not None:
+            count = selection_chunks(dset.shape, dset.chunks, sel)
+            print("  selection     {0} chunks, {1} read for {2} selected"
+                  .format(count, human_size(count * stored),
+                          human_size(selection_size(dset.shape, sel)
+                                     * dset.dtype.itemsize)))
+        if args.axis is not None:
+            axis = args.axis % len(dset.shape)
+            line = tuple(slice(None) if i == axis else 0
+                         for i in range(len(dset.shape)))
+            per_line = selection_chunks(dset.shape, dset.chunks, line)
+            lines = dset.size // max(dset.shape[axis], 1)
+            fits = per_line * chunk_bytes <= cache_bytes
+            reads = total if fits else lines * per_line
+            print("  {0:<14}{1} lines of {2} chunks each, {3} chunk reads"
+                  " ({4}) to read them all".format(
+                      "axis {} lines".format(axis), lines, per_line, reads,
+                      human_size(reads * stored)))
+            if not fits:
+                print("  WARNING: the chunks of one line do not fit in the"
+                      " chunk cache, each chunk is read {0} times"
+                      .format(reads // max(total, 1)))
+
+    def complete_chunks(self, text, line, begidx, endidx):
+        return self.complete_path(text, line, endidx)
+
+    def help_chunks(self):
+        print(dedent("""\
+                Storage layout and read cost diagnostics of a dataset
+                    chunks name[SELECTION] [-a AXIS]
+                Shows layout, filters, chunk shape, allocated chunks and
+                their stored sizes, and the chunk cache size. With a
+                selection (e.g. `chunks T[0:10, ::4]`), estimates the
+                chunks and bytes it reads. With -a, estimates the cost of
+                reading the dataset line by line along this axis."""))
+
+    def do_rechunk(self, s):
+        """Rewrite a dataset with new chunks and filters, block by block"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='rechunk')
+        parser.add_argument('name')
+        parser.add_argument('--chunks', default='auto')
+        parser.add_argument('--compression',
+                            choices=['gzip', 'lzf', 'none'])
+        parser.add_argument('--level', type=int)
+        parser.add_argument('--shuffle', action='store_true', default=None)
+        parser.add_argument('--no-shuffle', action='store_false',
+                            dest='shuffle')
+        args = parser.parse_args(s.split())
+        self.check_writable()
+        try:
+            src = self.get_elem(args.name)
+        except UnknownLabelError:
+            return
+        assert src.__class__.__name__ == "Dataset", \
+            args.name + " is not a dataset"
+        assert src.shape, "can not rechunk a scalar dataset"
+
+        if args.chunks == 'auto':
+            chunks = True
+        elif args.chunks in ('none', 'contiguous'):
+            chunks = None
+        else:
+            try:
+                chunks = tuple(int(n) for n in args.chunks.split(','))
+            except ValueError:
+                print("*** invalid chunks " + args.chunks)
+                return
+        compression, level = src.compression, src.compression_opts
+        if args.compression is not None:
+            compression = None if args.compression == 'none' \
+                else args.compression
+            level = None
+        if args.level is not None:
+            level = args.level
+        shuffle = src.shuffle if args.shuffle is None else args.shuffle
+
+        grp = src.parent
+        path = src.name
+        name = path.rsplit('/', 1)[1]
+        tmp, old = name + '.rechunk', name + '.old'
+        assert tmp not in grp and old not in grp, \
+            "{} or {} already exist".format(tmp, old)
+        try:
+            dst = grp.create_dataset(
+                tmp, shape=src.shape, dtype=src.dtype, chunks=chunks,
+                maxshape=src.maxshape, fillvalue=src.fillvalue,
+                compression=compression, compression_opts=level,
+                shuffle=shuffle, fletcher32=src.fletcher32)
+        except (ValueError, TypeError) as err:
+            print("*** " + str(err))
+            return
+        try:
+            for key in src.attrs:
+                dst.attrs.create(key, src.attrs[key],
+                                 dtype=src.attrs.get_id(key).dtype)
+            ones = (1,) * len(src.shape)
+            unit = common_unit(src.chunks or ones, dst.chunks or ones)
+            unit_size = src.dtype.itemsize * int(np.prod(
+                [min(u, n) for u, n in zip(unit, src.shape)]))
+            if unit_size > self.block_size:
+                # Chunk grids which do not divide each other: align on the
+                # new chunks only, source chunks being partially read
+                unit = dst.chunks or ones
+            block = block_shape(src, self.block_size, unit)
+            total = src.size * src.dtype.itemsize
+            done, start = 0, time.time()
+            for sel in iter_slices(src.shape, block):
+                data = src[sel]
+                dst[sel] = data
+                done += data.nbytes
+                rate = done / max(time.time() - start, 1e-6) / 1024 ** 2
+                print("\r--- {0:5.1f}% {1} / {2} ({3:.1f} MB/s)".format(
+                    100. * done / max(total, 1), human_size(done),
+                    human_size(total), rate), end='')
+                sys.stdout.flush()
+            print()
+        except BaseException:
+            del grp[tmp]
+            raise
+        grp.move(name, old)
+        grp.move(tmp, name)
+        del grp[old]
+        self.invalidate(path)
+        if self._index is not None:
+            self._index.add(make_entry(path, grp[name]))
+        if self._attrs is not None:
+            self._attrs.add(path, read_attrs(grp[name]))
+        print("--- rechunked {0}: chunks {1}, {2} on disk".format(
+            path, grp[name].chunks,
+            human_size(grp[name].id.get_storage_size())))
+
+    def complete_rechunk(self, text, line, begidx, endidx):
+        return self.complete_path(text, line, endidx)
+
+    def help_rechunk(self):
+        print(dedent("""\
+                Rewrite a dataset with new chunks and compression
+                    rechunk name [--chunks N,M,...|auto|none]
+                                 [--compression gzip|lzf|none] [--level L]
+                                 [--shuffle|--no-shuffle]
+                Data is copied block by block (see `blocksize`), blocks
+                being aligned on both the old and new chunk grids.
+                Attributes are kept. The new dataset replaces the old one
+                once complete. Unspecified filters are kept."""))
+
+    def do_watch(self, s):
+        """Repeat a command at regular intervals, until ^C"""
+        tokens = s.split()
+        count = None
+        if tokens[:1] == ['-n']:
+            try:
+                count = int(tokens[1])
+            except (IndexError, ValueError):
+                print("*** invalid count")
+                return
+            tokens = tokens[2:]
+        interval = 2.
+        try:
+            interval = float(tokens[-1])
+            tokens = tokens[:-1]
+        except (IndexError, ValueError):
+            pass
+        if not tokens:
+            print("*** no command to watch")
+            return
+        line = " ".join(tokens)
+        done = 0
+        try:
+            while count is None or done < count:
+                if done:
+                    time.sleep(interval)
+                print("--- {0} every {1}s: {2}".format(
+                    time.strftime("%H:%M:%S"), interval, line))
+                self.onecmd(line)
+                done += 1
+        except KeyboardInterrupt:
+            print()
+
+    def help_watch(self):
+        print(dedent("""\
+                Repeat a command every INTERVAL seconds (default 2), until ^C
+                    watch [-n COUNT] command [args] [INTERVAL]
+                e.g. `watch stats T 10` on a file opened with `open --swmr`:
+                each time, only the rows appended to T are read."""))
+
+    def do_cache(self, s):
+        """Show chunk caches, or set the one of a dataset"""
+        if self.h5file is None:
+            print("*** please open a file")
+            return
+        parser = CmdArgumentParser(prog='cache')
+        parser.add_argument('name', nargs='?')
+        parser.add_argument('--rdcc-nbytes', type=parse_size)
+        parser.add_argument('--rdcc-nslots', type=int)
+        parser.add_argument('--rdcc-w0', type=float)
+        args = parser.parse_args(s.split())
+        if args.name is None:
+            _, nslots, nbytes, w0 = self.h5file.id.get_access_plist(
+                ).get_cache()
+            print("file chunk cache: {0}, {1} slots, w0 {2}".format(
+                human_size(nbytes), nslots, w0))
+            return
+        try:
+            dset = self.get_elem(args.name)
+        except UnknownLabelError:
+            return
+        assert dset.__class__.__name__ == "Dataset", \
+            args.name + " is not a dataset"
+        nslots, nbytes, w0 = dset.id.get_access_plist().get_chunk_cache()
+        if (args.rdcc_nbytes, args.rdcc_nslots, args.rdcc_w0) != \
+                (None,) * 3:
+            nslots = args.rdcc_nslots or nslots
+            nbytes = args.rdcc_nbytes or nbytes
+            w0 = w0 if args.rdcc_w0 is None else args.rdcc_w0
+            self._chunk_caches[dset.name] = (nslots, nbytes, w0)
+        print("{0} chunk cache: {1}, {2} slots, w0 {3}".format(
+            dset.name, human_size(nbytes), nslots, w0))
+
+    def complete_cache(self, text, line, begidx, endidx):
+        return self.complete_path(text, line, endidx)
+
+    def help_cache(self):
+        print(dedent("""\
+                Show the file chunk cache, or show / set the chunk cache of
+                a dataset, used by all later commands on it
+                    cache [name [--rdcc-nbytes SIZE] [--rdcc-nslots N]
+                                [--rdcc-w0 W]]"""))
 
     def do_rm(self, s):
         """Delete a dataset or a group"""
@@ -483,16 +1815,17 @@ class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
         if len(s.split()) != 1:
             print("*** invalid number of arguments")
             return
+        self.check_writable()
         try:
             path = self.get_elem_abspath(s)
         except UnknownLabelError:
             return
         del self.h5file[path]
+        self.invalidate(path)
         print("--- deleted", path)
 
     def complete_rm(self, text, line, begidx, endidx):
-        return [f for f in [s.strip() for s in self.datasets]
-                if f.startswith(text)]
+        return self.complete_path(text, line, endidx)
 
     def help_rm(self):
         print("Delete a group or dataset.")
@@ -500,16 +1833,54 @@ class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
         print("There is no 'undo' or 'quit without save' feature")
 
     def get_elem_abspath(self, name):
-        """Get absolute path for dataset or group"""
-        return self.position + self.get_whitespace_name(name)
+        """Get absolute path for dataset or group
+
+        `name` is relative to the current group, or absolute if it starts
+        with '/'. It may span several levels, including '..'.
+        """
+        if '/' not in name and name != '..':
+            return self.position + self.get_whitespace_name(name)
+        path = '/' if name.startswith('/') else self.position
+        for part in name.split('/'):
+            if part in ('', '.'):
+                continue
+            if part == '..':
+                path = path.rstrip('/').rsplit('/', 1)[0] + '/'
+                continue
+            if self.kind(path) != 'Group':
+                print("*** {} is not a group".format(path.rstrip('/')))
+                raise UnknownLabelError
+            path += self.get_whitespace_name(part, path) + '/'
+        return path.rstrip('/') or '/'
+
+    def kind(self, path):
+        """Kind of object at absolute `path` (see `children`)"""
+        path = '/' + path.strip('/')
+        if path == '/':
+            return 'Group'
+        parent, name = path.rsplit('/', 1)
+        return self.children(parent + '/').get(name)
 
     def get_elem(self, name):
-        """Get dataset or group using name"""
-        return self.h5file[self.get_elem_abspath(name)]
+        """Get dataset or group using name
 
-    def get_whitespace_name(self, s):
+        Datasets with a chunk cache set by `cache` are opened with it.
+        """
+        path = self.get_elem_abspath(name)
+        if path in self._chunk_caches:
+            dapl = h5py.h5p.create(h5py.h5p.DATASET_ACCESS)
+            dapl.set_chunk_cache(*self._chunk_caches[path])
+            self.datasets_opened += 1
+            return h5py.Dataset(h5py.h5d.open(
+                self.h5file.id, path.encode('utf-8'), dapl=dapl))
+        elem = self.h5file[path]
+        if elem.__class__.__name__ == 'Dataset':
+            self.datasets_opened += 1
+        return elem
+
+    def get_whitespace_name(self, s, path=None):
         """Wrap search for names with leading whitespace(s)"""
-        targets = self.h5file[self.position].keys()
+        targets = self.children(path)
         for i in range(5):
             if s in targets:
                 return s
@@ -518,15 +1889,429 @@ class H5NavCmd(ExitCmd, ShellCmd, SmartCmd, cmd.Cmd, object):
         raise UnknownLabelError
 
 
+class ResourceProbe(object):
+    """Resource usage of the process since the probe was created
+
+    `counters` is a callable returning a dict of application counters,
+    reported as differences too. Bytes read and peak memory come from
+    /proc and are left out where it is not available.
+    """
+    def __init__(self, counters=dict):
+        self.counters = counters
+        reset_peak_rss()
+        self.start = self.sample()
+
+    def sample(self):
+        times = os.times()
+        return {'wall': time.time(), 'counters': self.counters(),
+                'cpu': sum(times[:4]), 'read': read_bytes()}
+
+    def report(self):
+        stop, start = self.sample(), self.start
+        items = ["wall {:.3f}s".format(stop['wall'] - start['wall']),
+                 "cpu {:.3f}s".format(stop['cpu'] - start['cpu'])]
+        if None not in (start['read'], stop['read']):
+            items.append("read " + human_size(stop['read'] - start['read']))
+        for key, value in stop['counters'].items():
+            items.append("{} {}".format(
+                key, value - start['counters'].get(key, 0)))
+        peak = peak_rss()
+        if peak is not None:
+            items.append("peak RSS " + human_size(peak))
+        return "--- " + ", ".join(items)
+
+
+def read_bytes():
+    """Bytes read by the process so far (rchar of /proc/self/io)"""
+    try:
+        with open('/proc/self/io') as fobj:
+            for line in fobj:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of the process (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fobj:
+            fobj.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def peak_rss():
+    """Peak resident memory in bytes, since the last reset if supported"""
+    try:
+        with open('/proc/self/status') as fobj:
+            for line in fobj:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
 class UnknownLabelError(Exception):
     pass
 
 
-def main():
+class CmdArgumentParser(argparse.ArgumentParser):
+    """Argument parser for commands options
+
+    Errors raise AssertionError, reported as usual by SmartCmd.onecmd
+    instead of exiting the interpreter.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault('add_help', False)
+        super(CmdArgumentParser, self).__init__(**kwargs)
+
+    def error(self, message):
+        raise AssertionError("{}: {}".format(self.prog, message))
+
+
+def pop_selection(s):
+    """Split `s` into the text outside brackets and the selection inside
+
+    'T[0:10, ::4] -a 1' gives ('T -a 1', (slice(0, 10), slice(None, None, 4)))
+    and the selection is None if there are no brackets.
+    """
+    match = re.search(r'\[(.*)\]', s)
+    if match is None:
+        return s, None
+    return (s[:match.start()] + ' ' + s[match.end():]).strip(), \
+        parse_selection(match.group(1))
+
+
+def parse_selection(text):
+    """Convert a numpy-like selection '0:10, ::4, 3' to a tuple"""
+    sel = []
+    parts = text.split(',')
+    if len(parts) > 1 and not parts[-1].strip():
+        parts.pop()
+    for part in parts:
+        part = part.strip()
+        try:
+            if ':' in part:
+                bounds = part.split(':')
+                assert len(bounds) <= 3, "invalid slice " + part
+                sel.append(slice(*[int(b) if b.strip() else None
+                                   for b in bounds]))
+            else:
+                sel.append(int(part))
+        except ValueError:
+            raise AssertionError("invalid selection [{}]".format(text))
+    return tuple(sel)
+
+
+def basename(path):
+    """Last component of an hdf5 path, without its leading whitespace"""
+    return path.rstrip('/').rsplit('/', 1)[-1].strip()
+
+
+def entry_name(entry):
+    """Name of an index entry, with a trailing '/' for groups"""
+    return entry.path.rsplit('/', 1)[-1] + (
+        '/' if entry.kind == 'Group' else '')
+
+
+def format_shape(shape):
+    if shape is None:
+        return "null"
+    return "x".join(str(n) for n in shape) or "scalar"
+
+
+def format_entry(entry):
+    """Columns of `ls -l`: size, shape, dtype and name"""
+    if entry.kind != 'Dataset':
+        return "{0:>8}  {1:<16} {2:<10} {3}".format(
+            "-", "-", "-", entry_name(entry))
+    return "{0:>8}  {1:<16} {2:<10} {3}".format(
+        human_size(entry.nbytes), format_shape(entry.shape), entry.dtype,
+        entry_name(entry))
+
+
+def human_size(nbytes):
+    """Convert a number of bytes to a short string like 1.5M"""
+    for unit in "BKMGT":
+        if abs(nbytes) < 1024 or unit == "T":
+            break
+        nbytes /= 1024.
+    if unit == "B":
+        return "{}B".format(int(nbytes))
+    return "{:.1f}{}".format(nbytes, unit)
+
+
+def parse_size(s):
+    """Convert a size like 512, 64K, 256M or 1G to a number of bytes"""
+    s = s.strip().upper().rstrip('B')
+    factor = 1
+    if s and s[-1] in "KMGT":
+        factor = 1024 ** ("KMGT".index(s[-1]) + 1)
+        s = s[:-1]
+    size = int(float(s) * factor)
+    if size <= 0:
+        raise ValueError("size must be positive")
+    return size
+
+
+OPEN_OPTIONS = ['rdcc_nbytes', 'rdcc_nslots', 'rdcc_w0', 'page_buf_size',
+                'driver']
+
+
+def config_path():
+    """Configuration file: $H5NAV_CONFIG or ~/.config/h5nav/config.ini"""
+    if os.environ.get('H5NAV_CONFIG'):
+        return os.environ['H5NAV_CONFIG']
+    root = os.environ.get('XDG_CONFIG_HOME') or \
+        os.path.expanduser('~/.config')
+    return os.path.join(root, 'h5nav', 'config.ini')
+
+
+def load_config(path=None):
+    """Settings of the configuration file, converted to python values
+
+    Supported settings are `block_size` in the [h5nav] section and the
+    `open` options (rdcc_nbytes, rdcc_nslots, rdcc_w0, page_buf_size,
+    driver) in the [open] section. Invalid settings are reported and
+    ignored.
+    """
+    try:
+        from configparser import ConfigParser, Error
+    except ImportError:
+        from ConfigParser import SafeConfigParser as ConfigParser, Error
+    converters = {'block_size': parse_size, 'rdcc_nbytes': parse_size,
+                  'page_buf_size': parse_size, 'rdcc_nslots': int,
+                  'rdcc_w0': float, 'driver': str}
+    known = {'h5nav': ['block_size'], 'open': OPEN_OPTIONS}
+    path = path or config_path()
+    parser = ConfigParser()
+    try:
+        parser.read(path)
+    except Error as err:
+        print("*** invalid configuration file {}: {}".format(path, err))
+        return {}
+    config = {}
+    for section, keys in known.items():
+        if not parser.has_section(section):
+            continue
+        for key, value in parser.items(section):
+            try:
+                assert key in keys, "unknown setting"
+                config.setdefault(section, {})[key] = converters[key](value)
+            except (AssertionError, ValueError) as err:
+                print("*** {0}: ignoring [{1}] {2} ({3})".format(
+                    path, section, key, err))
+    return config
+
+
+class ErrorWatcher(object):
+    """File-like wrapper spotting error lines ('*** ...') in an output
+
+    Error lines may be indented, as in the listings of `stats *`.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.errors = []
+        self._line = ''
+
+    def write(self, text):
+        if self.stream is not None:
+            self.stream.write(text)
+        lines = (self._line + text).split('\n')
+        self._line = lines.pop()
+        self.errors.extend(l.lstrip()[4:] for l in lines
+                           if l.lstrip().startswith('*** '))
+
+    def flush(self):
+        if self._line.lstrip().startswith('*** '):
+            self.errors.append(self._line.lstrip()[4:])
+            self._line = ''
+        if self.stream is not None:
+            self.stream.flush()
+
+
+class CaptureStream(object):
+    """File-like object appending everything written to a list"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def write(self, text):
+        self.chunks.append(text)
+
+    def flush(self):
+        pass
+
+
+def split_commands(text):
+    """Commands of a script: one per line or separated by ';'
+
+    Blank lines and lines starting with '#' are skipped.
+    """
+    commands = []
+    for line in text.splitlines():
+        if line.strip().startswith('#'):
+            continue
+        commands.extend(c.strip() for c in line.split(';') if c.strip())
+    return commands
+
+
+def run_commands(interpreter, commands, json_lines=False, keep_going=False,
+                 stream=None):
+    """Run commands without prompt, return an exit status
+
+    A command fails if it prints an error line ('*** ...') or raises.
+    Execution stops at the first failure unless `keep_going`. With
+    `json_lines`, the output of each command is reported as one JSON
+    object per line: command, status ('ok' or 'error'), output lines
+    and errors. `exit` stops the execution, keeping the status of the
+    commands run so far.
+    """
+    stream = stream or sys.stdout
+    status = 0
+    for line in commands:
+        exited = False
+        watcher = ErrorWatcher(None if json_lines else stream)
+        captured = []
+        if json_lines:
+            watcher.stream = CaptureStream(captured)
+        save = sys.stdout
+        sys.stdout = interpreter.stdout = watcher
+        try:
+            interpreter.onecmd(line)
+        except SystemExit as err:
+            exited = True
+            if err.code:
+                print("*** exit status {}".format(err.code))
+        except Exception as err:
+            print("*** {}: {}".format(err.__class__.__name__, err))
+        finally:
+            watcher.flush()
+            sys.stdout = interpreter.stdout = save
+        if json_lines:
+            stream.write(json.dumps(OrderedDict([
+                ('command', line),
+                ('status', 'error' if watcher.errors else 'ok'),
+                ('output', ''.join(captured).splitlines()),
+                ('errors', watcher.errors)])) + '\n')
+        if watcher.errors:
+            status = 1
+            if not keep_going:
+                break
+        if exited:
+            break
+    stream.flush()
+    return status
+
+
+def run_file(task):
+    """Worker: run commands on one file, return (status, output lines)"""
+    filename, commands, keep_going = task
+    chunks = []
+    interpreter = H5NavCmd()
+    interpreter.prefetching = False
+    try:
+        status = run_commands(interpreter, ['open ' + filename] + commands,
+                              keep_going=keep_going,
+                              stream=CaptureStream(chunks))
+    finally:
+        interpreter.do_close()
+    return status, ''.join(chunks).splitlines()
+
+
+def run_files(filenames, commands, jobs=1, json_lines=False,
+              keep_going=False, stream=None):
+    """Run commands on many files, with `jobs` processes
+
+    Results are printed as soon as available, in the order of
+    `filenames`, each output line being prefixed by its file name (or as
+    one JSON object per file). A failing file does not stop the others.
+    Returns an exit status.
+    """
+    stream = stream or sys.stdout
+    tasks = [(filename, commands, keep_going) for filename in filenames]
+    if jobs > 1:
+        results = parallel_map(run_file, tasks, jobs)
+    else:
+        results = (run_file(task) for task in tasks)
+    width = max([len(f) for f in filenames] + [0])
+    failed = []
+    for filename, (status, lines) in zip(filenames, results):
+        if status:
+            failed.append(filename)
+        if json_lines:
+            stream.write(json.dumps(OrderedDict([
+                ('file', filename),
+                ('status', 'error' if status else 'ok'),
+                ('output', lines)])) + '\n')
+        else:
+            for line in lines:
+                stream.write("{0:<{1}} | {2}\n".format(filename, width, line))
+        stream.flush()
+    if failed:
+        sys.stderr.write("*** {0}/{1} files failed: {2}\n".format(
+            len(failed), len(filenames), " ".join(failed)))
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='h5nav',
+        description="Interactive navigation of an hdf5 file. With -c or "
+                    "-s, commands are run without prompt and the exit "
+                    "status tells whether they all succeeded.")
+    parser.add_argument('filename', nargs='?', help="hdf5 file to open")
+    parser.add_argument('-c', '--command', action='append', default=[],
+                        help="commands to run, separated by ';'")
+    parser.add_argument('-s', '--script',
+                        help="file of commands to run, one per line")
+    parser.add_argument('--json', action='store_true',
+                        help="report each command as a JSON line")
+    parser.add_argument('-k', '--keep-going', action='store_true',
+                        help="do not stop at the first failing command")
+    parser.add_argument('--files', action='append', default=[],
+                        help="run the commands on every file matching "
+                             "this glob pattern (may be repeated)")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="with --files, number of worker processes")
+    args = parser.parse_args(argv)
+
     interpreter = H5NavCmd()
-    if sys.argv[1:]:
-        interpreter.do_open(sys.argv[1])
-    interpreter.cmdloop_with_keyboard_interrupt()
+    if not (args.command or args.script):
+        if args.files:
+            parser.error("--files needs commands (-c or -s)")
+        if args.filename:
+            interpreter.do_open(args.filename)
+        interpreter.cmdloop_with_keyboard_interrupt()
+        return
+    # Commands run back to back: a prefetch would only compete with them
+    interpreter.prefetching = False
+
+    commands = []
+    if args.script:
+        with open(args.script) as fin:
+            commands.extend(split_commands(fin.read()))
+    for text in args.command:
+        commands.extend(split_commands(text))
+    if args.files:
+        filenames = sorted(set(f for pattern in args.files
+                               for f in glob(pattern)))
+        if args.filename:
+            filenames.insert(0, args.filename)
+        sys.exit(run_files(filenames, commands, args.jobs, args.json,
+                           args.keep_going))
+    if args.filename:
+        commands.insert(0, 'open ' + args.filename)
+    status = run_commands(interpreter, commands, args.json, args.keep_going)
+    interpreter.do_close()
+    sys.exit(status)
 
 
 if __name__ == '__main__':
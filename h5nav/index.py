@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+"""
+index.py
+
+in-memory index of the whole hierarchy of an hdf5 file
+
+The index is filled by a single walk of the file and then answers path,
+name and metadata queries without touching the file again.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import re
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, namedtuple
+from fnmatch import fnmatchcase
+
+from .lazy import LazyModule
+
+np = LazyModule('numpy')
+h5py = LazyModule('h5py')
+
+Entry = namedtuple('Entry', 'path kind shape dtype layout chunks nbytes')
+
+LAYOUTS = {0: 'compact', 1: 'contiguous', 2: 'chunked', 3: 'virtual'}
+
+
+def make_entry(path, obj):
+    """Index entry of h5py object `obj` found at absolute `path`"""
+    kind = obj.__class__.__name__
+    if kind != 'Dataset':
+        return Entry(path, kind, None, None, None, None, 0)
+    try:
+        layout = obj.id.get_create_plist().get_layout()
+    except (AttributeError, ValueError, RuntimeError):
+        layout = None
+    shape = obj.shape
+    nbytes = 0
+    if shape is not None:
+        nbytes = int(np.prod(shape)) * obj.dtype.itemsize
+    return Entry(path, kind, shape, str(obj.dtype),
+                 LAYOUTS.get(layout, layout), obj.chunks, nbytes)
+
+
+def read_attrs(obj):
+    """All attributes of h5py object `obj`, read in one go
+
+    Attributes which can not be read (e.g. unsupported datatypes) are
+    given as None.
+    """
+    attrs = OrderedDict()
+    for key in obj.attrs:
+        try:
+            attrs[key] = obj.attrs[key]
+        except (OSError, IOError, TypeError, ValueError):
+            attrs[key] = None
+    return attrs
+
+
+def format_attr(value):
+    """Text of an attribute value, as shown and matched by queries"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if getattr(value, 'size', 1) > 20:
+        return np.array2string(value, threshold=20, separator=', ')
+    if hasattr(value, 'tolist'):
+        value = value.tolist()
+        if isinstance(value, list):
+            return str([format_attr(v) for v in value]).replace("'", "")
+        if isinstance(value, bytes):
+            return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+def basename(path):
+    return path.rstrip('/').rsplit('/', 1)[-1]
+
+
+class TreeIndex(object):
+    """Path, kind, shape, dtype and storage layout of all objects of a file
+
+    The file is walked once with `visititems`, which relies on H5Ovisit:
+    each object is visited once whatever the number of hard links
+    pointing to it, so cycles can not occur and shared objects are indexed
+    under the first path found. Soft links are not indexed either: `resolve`
+    gives the indexed path of objects reached through them.
+    """
+    def __init__(self, entries):
+        self.entries = dict((entry.path, entry) for entry in entries)
+        self.paths = sorted(self.entries)
+        self.by_name = {}
+        for path in self.paths:
+            self.by_name.setdefault(basename(path), []).append(path)
+        self._members = None
+        self._fields = None
+        self._addresses = None
+
+    @classmethod
+    def from_file(cls, h5file):
+        """Index built from a walk of the whole file"""
+        entries = [Entry('/', 'Group', None, None, None, None, 0)]
+
+        def add(name, obj):
+            entries.append(make_entry('/' + name, obj))
+        h5file.visititems(add)
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __getitem__(self, path):
+        return self.entries[path]
+
+    def under(self, root='/'):
+        """Sorted paths of all objects below group `root` (excluded)"""
+        start, stop = self._span(root)
+        return [path for path in self.paths[start:stop] if path != root]
+
+    def _span(self, root):
+        """Slice of `paths` holding the objects below `root`"""
+        prefix = root.rstrip('/') + '/'
+        start = bisect_left(self.paths, prefix)
+        return start, bisect_left(self.paths, prefix[:-1] + chr(ord('/') + 1),
+                                  start)
+
+    def add(self, entry):
+        """Index a new object"""
+        if entry.path not in self.entries:
+            insort(self.paths, entry.path)
+            self.by_name.setdefault(basename(entry.path), []).append(
+                entry.path)
+            self._members = None
+        self.entries[entry.path] = entry
+        self._fields = None
+        self._addresses = None
+
+    def remove(self, path):
+        """Forget object `path` and everything below it"""
+        path = '/' + path.strip('/')
+        gone = set([path] + self.under(path)) & set(self.entries)
+        for old in gone:
+            del self.entries[old]
+            siblings = self.by_name[basename(old)]
+            siblings.remove(old)
+            if not siblings:
+                del self.by_name[basename(old)]
+        self.paths = [p for p in self.paths if p not in gone]
+        self._members = None
+        self._fields = None
+        self._addresses = None
+
+    def resolve(self, h5file, path):
+        """Indexed path of the object found at `path` in `h5file`, or None
+
+        Objects reached through soft links or through other hard links than
+        the indexed one are found by their address: the map of addresses to
+        indexed paths is built by a walk of the file on first use. None is
+        returned for missing objects and objects of other files.
+        """
+        path = '/' + path.strip('/')
+        if path in self.entries:
+            return path
+        try:
+            info = h5py.h5o.get_info(h5file[path].id)
+        except (KeyError, ValueError):
+            return None
+        if info.fileno != h5py.h5o.get_info(h5file.id).fileno:
+            return None
+        if self._addresses is None:
+            addresses = {h5py.h5o.get_info(h5file.id).addr: '/'}
+
+            def add(name, obj):
+                addresses.setdefault(h5py.h5o.get_info(obj.id).addr,
+                                     '/' + name)
+            h5file.visititems(add)
+            self._addresses = addresses
+        return self._addresses.get(info.addr)
+
+    def members(self, group='/'):
+        """Paths of the members of `group`, sorted by name
+
+        The map of all groups to their members is built in one pass over
+        the index on first use, and dropped when the index changes.
+        """
+        if self._members is None:
+            self._members = {}
+            for path in self.paths:
+                if path == '/':
+                    continue
+                parent = path.rsplit('/', 1)[0] or '/'
+                self._members.setdefault(parent, []).append(path)
+            for paths in self._members.values():
+                paths.sort(key=basename)
+        return self._members.get('/' + group.strip('/'), [])
+
+    def walk(self, root='/', depth=None):
+        """Depth-first walk below group `root`, down to `depth` levels
+
+        Yields (level, entry, last) tuples, level 1 being the members of
+        `root` and `last` telling whether entry is the last member of its
+        group. An explicit stack is used rather than recursion, so that
+        the depth of the hierarchy is not limited.
+        """
+        stack = [(1, path, i == 0)
+                 for i, path in enumerate(reversed(self.members(root)))]
+        while stack:
+            level, path, last = stack.pop()
+            yield level, self.entries[path], last
+            if depth is None or level < depth:
+                stack.extend(
+                    (level + 1, member, i == 0)
+                    for i, member in enumerate(reversed(self.members(path))))
+
+    def fields(self):
+        """Secondary indexes of `find`, built on first use
+
+        Paths grouped by kind, dtype and shape, the sorted distinct names,
+        and all paths sorted by size in bytes. Like the members of groups,
+        they are dropped when the index changes.
+        """
+        if self._fields is None:
+            groups = {'kind': {}, 'dtype': {}, 'shape': {}}
+            for entry in self.entries.values():
+                for field in groups:
+                    value = getattr(entry, field)
+                    if value is not None:
+                        groups[field].setdefault(value, []).append(
+                            entry.path)
+            sizes = sorted((entry.nbytes, entry.path)
+                           for entry in self.entries.values())
+            self._fields = dict(groups, names=sorted(self.by_name),
+                                nbytes=[nbytes for nbytes, _ in sizes],
+                                by_size=[path for _, path in sizes])
+        return self._fields
+
+    def _candidates(self, root, name, kind, dtype, shape, size):
+        """Smallest list of paths holding all the matches of `find`
+
+        Each indexed predicate gives slices (paths, start, stop) of
+        lists of paths, whose total length is known before any of them is
+        read: only the shortest option is built.
+        """
+        def whole(paths):
+            return paths, 0, len(paths)
+        fields = self.fields()
+        options = [[(self.paths,) + self._span(root)]]
+        if name is not None:
+            literal = re.split(r'[*?\[]', name, 1)[0]
+            if literal == name:
+                options.append([whole(self.by_name.get(name, []))])
+            else:
+                names = fields['names']
+                first = bisect_left(names, literal)
+                last = len(names)
+                if literal:
+                    last = bisect_left(
+                        names, literal[:-1] + chr(ord(literal[-1]) + 1), first)
+                options.append([whole(self.by_name[key])
+                                for key in names[first:last]
+                                if fnmatchcase(key, name)])
+        if kind is not None:
+            options.append([whole(fields['kind'].get(kind, []))])
+        if dtype is not None:
+            options.append([whole(paths)
+                            for key, paths in fields['dtype'].items()
+                            if key.startswith(dtype)])
+        if shape is not None:
+            options.append([whole(paths)
+                            for key, paths in fields['shape'].items()
+                            if match_shape(key, shape)])
+        if size is not None:
+            nbytes = fields['nbytes']
+            operator, value = size
+            first, last = 0, len(nbytes)
+            if operator != '<':
+                first = (bisect_right if operator == '>' else bisect_left)(
+                    nbytes, value)
+            if operator != '>':
+                last = (bisect_left if operator == '<' else bisect_right)(
+                    nbytes, value)
+            options.append([(fields['by_size'], first, last)])
+        best = min(options, key=lambda slices: sum(
+            stop - start for _, start, stop in slices))
+        if best is options[0]:
+            paths, start, stop = best[0]
+            return paths[start:stop]
+        return sorted(path for paths, start, stop in best
+                      for path in paths[start:stop])
+
+    def find(self, root='/', name=None, path=None, regex=None, kind=None,
+             dtype=None, shape=None, size=None):
+        """Entries below `root` matching all the given predicates
+
+        - name: glob on the object name, path: glob on the absolute path
+        - regex: regular expression searched in the absolute path
+        - kind: 'Group' or 'Dataset'
+        - dtype: dtype name, or its beginning ('float' for all floats)
+        - shape: tuple of ints, None standing for any length
+        - size: (operator, bytes), operator being one of '<', '=', '>'
+
+        Candidates are taken from the most selective of the indexed
+        predicates (root, name, kind, dtype, shape and size), then checked
+        against all of them.
+        """
+        prefix = root.rstrip('/') + '/'
+        if regex is not None:
+            regex = re.compile(regex)
+        for cand in self._candidates(root, name, kind, dtype, shape, size):
+            entry = self.entries[cand]
+            if cand == root or not cand.startswith(prefix):
+                continue
+            if name is not None and not fnmatchcase(basename(cand), name):
+                continue
+            if path is not None and not fnmatchcase(cand, path):
+                continue
+            if regex is not None and not regex.search(cand):
+                continue
+            if kind is not None and entry.kind != kind:
+                continue
+            if dtype is not None and not (entry.dtype or '').startswith(
+                    dtype):
+                continue
+            if shape is not None and not match_shape(entry.shape, shape):
+                continue
+            if size is not None and not match_size(entry.nbytes, *size):
+                continue
+            yield entry
+
+
+def match_shape(shape, pattern):
+    if shape is None or len(shape) != len(pattern):
+        return False
+    return all(p is None or p == n for n, p in zip(shape, pattern))
+
+
+def match_size(nbytes, operator, value):
+    if operator == '<':
+        return nbytes < value
+    if operator == '>':
+        return nbytes > value
+    return nbytes == value
+
+
+class PathTrie(object):
+    """Sorted member names of groups, for prefix completion of paths
+
+    Each node is a group listing, keyed by its path ('/a/b/') and filled
+    on demand with `add`. Names are sorted on their stripped form (names
+    with leading whitespace are completed without it), so the members
+    starting with a prefix are a slice found by bisection.
+    """
+    def __init__(self):
+        self.nodes = {}
+
+    def __contains__(self, group):
+        return group in self.nodes
+
+    def add(self, group, listing):
+        """Store `listing`, a dict of member names to kinds"""
+        members = sorted((name.lstrip(), name, kind)
+                         for name, kind in listing.items())
+        self.nodes[group] = ([key for key, _, _ in members], members)
+
+    def lookup(self, group, key):
+        """(name, kind) of the member of `group` named `key`, or None"""
+        keys, members = self.nodes[group]
+        pos = bisect_left(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            return members[pos][1:]
+        return None
+
+    def complete(self, group, prefix):
+        """(key, name, kind) of the members of `group` starting with
+        `prefix`"""
+        keys, members = self.nodes[group]
+        start = bisect_left(keys, prefix)
+        stop = len(keys)
+        if prefix:
+            stop = bisect_left(keys, prefix[:-1] + chr(ord(prefix[-1]) + 1),
+                               start)
+        return members[start:stop]
+
+    def remove(self, path):
+        """Forget group `path`, its descendants and its parent"""
+        path = '/' + path.strip('/')
+        parent = path.rsplit('/', 1)[0] + '/'
+        for group in list(self.nodes):
+            if group == parent or group.startswith(path.rstrip('/') + '/'):
+                del self.nodes[group]
+
+
+class AttrIndex(object):
+    """Attributes of all objects of a file, with a key -> paths index
+
+    Only objects with attributes are stored. Like `TreeIndex`, it is
+    filled by one `visititems` walk, during which all the attributes of
+    each object are read at once.
+    """
+    def __init__(self, attrs):
+        self.attrs = {}
+        self.by_key = {}
+        for path, values in attrs:
+            self.add(path, values)
+
+    @classmethod
+    def from_file(cls, h5file, entries=None):
+        """Index built from a walk of the whole file
+
+        If `entries` is a list, the `TreeIndex` entries of the objects
+        are appended to it during the same walk.
+        """
+        attrs = [('/', read_attrs(h5file))]
+        if entries is not None:
+            entries.append(Entry('/', 'Group', None, None, None, None, 0))
+
+        def add(name, obj):
+            attrs.append(('/' + name, read_attrs(obj)))
+            if entries is not None:
+                entries.append(make_entry('/' + name, obj))
+        h5file.visititems(add)
+        return cls(attrs)
+
+    def __contains__(self, path):
+        return path in self.attrs
+
+    def get(self, path):
+        """Attributes of object `path` (an empty dict if it has none)"""
+        return self.attrs.get(path, OrderedDict())
+
+    def add(self, path, values):
+        """Store the attributes of object `path`, replacing older ones"""
+        self.remove(path, recursive=False)
+        if not values:
+            return
+        self.attrs[path] = values
+        for key in values:
+            insort(self.by_key.setdefault(key, []), path)
+
+    def remove(self, path, recursive=True):
+        """Forget the attributes of `path`, and of objects below it"""
+        path = '/' + path.strip('/')
+        prefix = path.rstrip('/') + '/'
+        gone = [p for p in self.attrs
+                if p == path or (recursive and p.startswith(prefix))]
+        for old in gone:
+            for key in self.attrs.pop(old):
+                paths = self.by_key[key]
+                paths.remove(old)
+                if not paths:
+                    del self.by_key[key]
+
+    def under(self, root='/'):
+        """Sorted paths of the objects with attributes in `root`
+        (included) and below"""
+        root = '/' + root.strip('/')
+        prefix = root.rstrip('/') + '/'
+        return sorted(p for p in self.attrs
+                      if p == root or p.startswith(prefix))
+
+    def find(self, key, value=None, root='/'):
+        """Sorted paths of the objects in `root` (included) and below
+        with attribute `key`
+
+        If `value` is given, the attribute must also match it: as a
+        number if both are numbers, else as a glob on its text.
+        """
+        root = '/' + root.strip('/')
+        prefix = root.rstrip('/') + '/'
+        for path in self.by_key.get(key, []):
+            if path != root and not path.startswith(prefix):
+                continue
+            if value is None or match_attr(self.attrs[path][key], value):
+                yield path
+
+
+def match_attr(attr, pattern):
+    try:
+        return float(attr) == float(pattern)
+    except (TypeError, ValueError):
+        return fnmatchcase(format_attr(attr), pattern)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""
+lazy.py
+
+deferred imports of heavy modules (numpy, h5py), to keep startup fast
+"""
+
+from __future__ import absolute_import
+
+import importlib
+
+
+class LazyModule(object):
+    """Stand-in for a module, imported on first attribute access"""
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self.__module is not None else "not loaded"
+        return "<lazy module '{}' ({})>".format(self.__name, state)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+prefetch.py
+
+background prefetch of group listings
+
+After a `cd`, a worker thread lists the new position and its subgroups,
+so that `ls` and completion find them already cached. Only the last
+request matters: scheduling a new one drops the pending ones. The thread
+exits as soon as its queue is empty, and is started again on demand.
+"""
+
+from __future__ import absolute_import
+
+import threading
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+
+class Prefetcher(object):
+    """Worker thread calling `load(path)` on scheduled paths
+
+    `load` returns the paths of the subgroups of `path`, which are
+    queued in turn until `depth` levels are done or the queue, bounded to
+    `maxsize` items, is full. Errors of `load` (e.g. objects removed in
+    the meantime) are ignored: prefetching is only a hint.
+
+    `load` is only referenced by pending requests, so that an idle
+    prefetcher does not keep its owner (and its open file) alive.
+    """
+    def __init__(self, depth=1, maxsize=256):
+        self.depth = depth
+        self.queue = Queue(maxsize)
+        self._mutex = threading.Lock()
+        self._thread = None
+        self._generation = 0
+
+    def schedule(self, load, path):
+        """Prefetch `path` and its subgroups, dropping pending requests"""
+        with self._mutex:
+            self._drain()
+            self.queue.put_nowait((load, path, 0, self._generation))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='h5nav-prefetch')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def cancel(self):
+        """Drop pending requests (the one in progress is completed)"""
+        with self._mutex:
+            self._drain()
+
+    def wait(self):
+        """Block until the worker is done"""
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _drain(self):
+        self._generation += 1
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                return
+
+    def _run(self):
+        while True:
+            with self._mutex:
+                try:
+                    load, path, level, generation = self.queue.get_nowait()
+                except Empty:
+                    self._thread = None
+                    return
+            if generation != self._generation:
+                continue
+            try:
+                subgroups = load(path)
+            except (KeyError, ValueError, RuntimeError, OSError):
+                continue
+            if level >= self.depth:
+                continue
+            # Under the mutex, so that `schedule` always finds room after
+            # draining the queue, and stale subgroups are not queued
+            with self._mutex:
+                if generation != self._generation:
+                    continue
+                for sub in subgroups:
+                    try:
+                        self.queue.put_nowait((load, sub, level + 1,
+                                               generation))
+                    except Full:
+                        break
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+sidecar.py
+
+persistent SQLite cache of the index and statistics of hdf5 files
+
+One database is kept per hdf5 file in the cache directory
+(~/.cache/h5nav by default). The hierarchy it holds is valid as long as
+the size and modification time of the hdf5 file are unchanged; once the
+file is modified, it is rebuilt by a full walk of the file, as nothing
+tells which groups changed short of visiting them all. Statistics are
+stored with a signature of their dataset (shape, dtype and HDF5
+modification time), and are all expired when the file is modified: the
+HDF5 modification time of a dataset does not change when its data is
+rewritten in place. Expired statistics are only used to resume those of
+datasets which were appended to, reading the new rows only.
+"""
+
+from __future__ import absolute_import
+
+import os
+import json
+from hashlib import sha1
+from os.path import abspath, expanduser, getmtime, getsize, isdir, join
+
+from .index import Entry
+from .stream import Moments
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY, kind TEXT, shape TEXT, dtype TEXT,
+    layout TEXT, chunks TEXT, nbytes INTEGER);
+CREATE TABLE IF NOT EXISTS stats (
+    path TEXT PRIMARY KEY, signature TEXT, count INTEGER,
+    mean TEXT, m2 TEXT, min TEXT, max TEXT);
+"""
+
+
+def default_cache_dir():
+    """Cache directory, following the XDG base directory specification"""
+    root = os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    return join(root, 'h5nav')
+
+
+def dataset_signature(dset):
+    """Signature telling whether cached statistics are still valid"""
+    from h5py import h5o
+    try:
+        mtime = h5o.get_info(dset.id).mtime
+    except (AttributeError, RuntimeError):
+        mtime = 0
+    return json.dumps([dset.shape, str(dset.dtype), mtime])
+
+
+def _loads_number(text):
+    value = json.loads(text)
+    return complex(*value) if isinstance(value, list) else value
+
+
+def _dumps_number(value):
+    value = value.item() if hasattr(value, 'item') else value
+    if isinstance(value, complex):
+        return json.dumps([value.real, value.imag])
+    return json.dumps(value)
+
+
+class Sidecar(object):
+    """Sidecar cache database of hdf5 file `filename`"""
+    def __init__(self, filename, directory=None):
+        import sqlite3
+        self.filename = abspath(filename)
+        directory = directory or default_cache_dir()
+        if not isdir(directory):
+            os.makedirs(directory)
+        digest = sha1(self.filename.encode('utf-8')).hexdigest()
+        self.db = sqlite3.connect(join(directory, digest + '.sqlite'))
+        self.db.executescript(SCHEMA)
+        # Taken before the file is opened, which may touch it
+        self.opened = self.file_signature()
+        if not self.valid:
+            self.expire_stats()
+
+    def close(self):
+        self.db.close()
+
+    def file_signature(self):
+        return json.dumps([self.filename, getsize(self.filename),
+                           getmtime(self.filename)])
+
+    @property
+    def unchanged(self):
+        """True if the file was not modified since the sidecar was opened"""
+        return self.file_signature() == self.opened
+
+    @property
+    def valid(self):
+        """True if the stored hierarchy matches the file on disk"""
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key='file'").fetchone()
+        return row is not None and row[0] == self.file_signature()
+
+    def expire_stats(self):
+        """Make stored statistics unusable by `get_stats`
+
+        Their shape and dtype are kept for `last_stats`.
+        """
+        rows = self.db.execute("SELECT path, signature FROM stats").fetchall()
+        with self.db:
+            for path, signature in rows:
+                shape, dtype, _ = json.loads(signature)
+                self.db.execute(
+                    "UPDATE stats SET signature = ? WHERE path = ?",
+                    (json.dumps([shape, dtype, None]), path))
+
+    def load_index(self):
+        """Stored index entries, or None if missing or stale"""
+        if not self.valid:
+            return None
+        return [Entry(path, kind, _tuple(shape), dtype, layout,
+                      _tuple(chunks), nbytes)
+                for path, kind, shape, dtype, layout, chunks, nbytes
+                in self.db.execute("SELECT * FROM entries")]
+
+    def save_index(self, entries):
+        """Replace the stored hierarchy, stamped with the file signature
+
+        Statistics of datasets which disappeared are dropped, the others
+        are kept: their own signature is checked when they are read.
+        """
+        with self.db:
+            self.db.execute("DELETE FROM entries")
+            self.db.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((e.path, e.kind, json.dumps(e.shape), e.dtype, e.layout,
+                  json.dumps(e.chunks), e.nbytes) for e in entries))
+            self.db.execute("DELETE FROM stats WHERE path NOT IN "
+                            "(SELECT path FROM entries)")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('file', ?)",
+                            (self.file_signature(),))
+
+    def drop(self, path):
+        """Forget statistics of object `path` and of all objects below it"""
+        prefix = path.rstrip('/') + '/'
+        with self.db:
+            self.db.execute("DELETE FROM stats WHERE path = ? OR "
+                            "substr(path, 1, ?) = ?",
+                            (path, len(prefix), prefix))
+
+    def get_stats(self, path, signature):
+        """Cached Moments of dataset `path`, or None"""
+        row = self.db.execute(
+            "SELECT count, mean, m2, min, max FROM stats "
+            "WHERE path = ? AND signature = ?", (path, signature)).fetchone()
+        if row is None:
+            return None
+        count, mean, m2, mini, maxi = row
+        return Moments(count, _loads_number(mean), _loads_number(m2),
+                       _loads_number(mini), _loads_number(maxi))
+
+    def last_stats(self, path):
+        """Last (shape, dtype, Moments) stored for dataset `path`, or None
+
+        Unlike `get_stats`, the signature is not checked: this is meant to
+        resume statistics of datasets which were appended to.
+        """
+        row = self.db.execute(
+            "SELECT signature, count, mean, m2, min, max FROM stats "
+            "WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        signature, count, mean, m2, mini, maxi = row
+        shape, dtype, _ = json.loads(signature)
+        return tuple(shape), dtype, Moments(
+            count, _loads_number(mean), _loads_number(m2),
+            _loads_number(mini), _loads_number(maxi))
+
+    def put_stats(self, path, signature, mom):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, signature, mom.count, _dumps_number(mom.mean),
+                 _dumps_number(mom.m2), _dumps_number(mom.min),
+                 _dumps_number(mom.max)))
+
+
+def _tuple(text):
+    value = json.loads(text)
+    return None if value is None else tuple(value)
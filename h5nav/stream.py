@@ -0,0 +1,594 @@
+#!/usr/bin/env python
+"""
+stream.py
+
+block-wise (out-of-core) reductions over hdf5 datasets
+
+Datasets are never loaded as a whole: they are read block by block, each
+block being aligned on the HDF5 chunk grid (or made of full rows for
+contiguous layouts) and holding at most `block_size` bytes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import ast
+import operator
+import itertools
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
+from .lazy import LazyModule
+
+np = LazyModule('numpy')
+
+BLOCK_SIZE = 64 * 1024 ** 2
+
+
+def block_shape(dset, block_size=BLOCK_SIZE, unit=None):
+    """Shape of the reading blocks for dataset `dset`
+
+    Blocks are grown from the dataset chunk shape (one element for
+    contiguous datasets) or from `unit` if given, last axis first, by
+    whole units as long as they fit in `block_size` bytes. At least one
+    unit is always read.
+    """
+    shape = dset.shape
+    unit = unit or dset.chunks or (1,) * len(shape)
+    budget = max(block_size // max(dset.dtype.itemsize, 1), 1)
+    block = [min(u, s) for u, s in zip(unit, shape)]
+    for axis in reversed(range(len(shape))):
+        others = int(np.prod(block)) // max(block[axis], 1)
+        length = budget // max(others, 1)
+        if length < shape[axis]:
+            length = length // unit[axis] * unit[axis]
+        block[axis] = min(max(block[axis], length), shape[axis])
+        if block[axis] < shape[axis]:
+            break
+    return tuple(block)
+
+
+def iter_slices(shape, block):
+    """Yield the tuples of slices tiling `shape` with blocks of `block`"""
+    starts = [range(0, n, b) for n, b in zip(shape, block)]
+    for corner in itertools.product(*starts):
+        yield tuple(slice(c, min(c + b, n))
+                    for c, b, n in zip(corner, block, shape))
+
+
+def common_unit(*chunks):
+    """Smallest block shape aligned on all the given chunk grids"""
+    unit = [1] * len(chunks[0])
+    for chunk in chunks:
+        for axis, length in enumerate(chunk):
+            unit[axis] = unit[axis] * length // gcd(unit[axis], length)
+    return tuple(unit)
+
+
+def iter_blocks(dset, block_size=BLOCK_SIZE, start=0):
+    """Yield (selection, ndarray) blocks covering the whole dataset
+
+    With `start`, only rows from `start` on (along axis 0) are read.
+    """
+    if dset.shape is None:
+        return
+    if dset.shape == ():
+        if start == 0:
+            yield (), np.asarray(dset[()])
+        return
+    if dset.size == 0 or start >= dset.shape[0]:
+        return
+    shape = (dset.shape[0] - start,) + dset.shape[1:]
+    for sel in iter_slices(shape, block_shape(dset, block_size)):
+        sel = (slice(sel[0].start + start, sel[0].stop + start),) + sel[1:]
+        yield sel, dset[sel]
+
+
+class Moments(object):
+    """Mergeable count, mean, M2, min and max of a stream of arrays
+
+    Partial moments are combined with the pairwise formulas of Chan et al.,
+    which stay numerically stable for any number of blocks.
+    """
+    def __init__(self, count=0, mean=0., m2=0., mini=None, maxi=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.min = mini
+        self.max = maxi
+
+    def update(self, block):
+        """Add the values of ndarray `block`"""
+        block = np.asarray(block)
+        if block.size == 0:
+            return self
+        if block.dtype.kind in 'biuf':
+            values = block.astype(np.float64, copy=False)
+        elif block.dtype.kind == 'c':
+            values = block.astype(np.complex128, copy=False)
+        else:
+            raise TypeError("moments undefined for dtype " + str(block.dtype))
+        mean = values.mean()
+        m2 = (abs(values - mean) ** 2).sum()
+        return self.merge(Moments(block.size, mean, m2,
+                                  block.min(), block.max()))
+
+    def merge(self, other):
+        """Combine with the partial moments `other` (in place)"""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = (self.m2 + other.m2
+                   + abs(delta) ** 2 * self.count * other.count / count)
+        self.count = count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        return self
+
+    @property
+    def std(self):
+        """Population standard deviation (same as numpy.std)"""
+        return np.sqrt(self.m2 / self.count)
+
+
+def moments(dset, block_size=BLOCK_SIZE, start=0):
+    """Single pass moments of a dataset (from row `start`), block by block"""
+    mom = Moments()
+    for _, block in iter_blocks(dset, block_size, start):
+        mom.update(block)
+    return mom
+
+
+def value_range(dset, block_size=BLOCK_SIZE, positive=False):
+    """Min and max of a dataset ignoring NaNs, read block by block
+
+    With `positive`, only strictly positive values are considered (range
+    of logarithmic bins). Returns (None, None) if no value qualifies.
+    """
+    lo, hi = None, None
+    for _, block in iter_blocks(dset, block_size):
+        if block.dtype.kind not in 'biuf':
+            raise TypeError("range undefined for dtype " + str(block.dtype))
+        block = block[~np.isnan(block)] if block.dtype.kind == 'f' else block
+        if positive:
+            block = block[block > 0]
+        if block.size == 0:
+            continue
+        bmin, bmax = block.min(), block.max()
+        lo = bmin if lo is None else min(lo, bmin)
+        hi = bmax if hi is None else max(hi, bmax)
+    return lo, hi
+
+
+def bin_edges(lo, hi, bins=10, log=False):
+    """Histogram bin edges, following numpy.histogram conventions"""
+    lo, hi = float(lo), float(hi)
+    if log:
+        if lo <= 0:
+            raise ValueError("logarithmic bins need a positive range")
+        if lo == hi:
+            lo, hi = lo / 2, hi * 2
+        return np.logspace(np.log10(lo), np.log10(hi), bins + 1)
+    if lo == hi:
+        lo, hi = lo - 0.5, hi + 0.5
+    return np.linspace(lo, hi, bins + 1)
+
+
+def histogram(dset, edges, block_size=BLOCK_SIZE):
+    """Counts of dataset values in bins, accumulated block by block
+
+    Bins are half open except the last one, values out of the edges or
+    NaN are ignored: results are the same as numpy.histogram.
+    """
+    bins = len(edges) - 1
+    counts = np.zeros(bins, dtype=np.int64)
+    for _, block in iter_blocks(dset, block_size):
+        if block.dtype.kind not in 'biuf':
+            raise TypeError("histogram undefined for dtype "
+                            + str(block.dtype))
+        values = block.ravel()
+        idx = np.searchsorted(edges, values, side='right') - 1
+        idx[values == edges[-1]] = bins - 1
+        idx = idx[(idx >= 0) & (idx < bins)]
+        counts += np.bincount(idx, minlength=bins)
+    return counts
+
+
+def open_readonly(filename, **kwargs):
+    """Own read-only handle on a file, e.g. in a worker process
+
+    HDF5 file locking is disabled when possible, so that the file may stay
+    open for writing in the interactive session. Pass swmr=True to read a
+    file written by another process in SWMR mode.
+    """
+    from h5py import File
+    try:
+        return File(filename, 'r', locking=False, **kwargs)
+    except TypeError:
+        return File(filename, 'r', **kwargs)
+
+
+def moments_task(task):
+    """Worker: moments of dataset `path` in file `filename`"""
+    filename, path, block_size, swmr = task
+    try:
+        with open_readonly(filename, swmr=swmr) as h5f:
+            return moments(h5f[path], block_size)
+    except Exception as err:
+        return err
+
+
+def histogram_task(task):
+    """Worker: (min, max, counts) of dataset `path` in file `filename`
+
+    The range is computed on the dataset if `value_range` is None.
+    """
+    filename, path, block_size, bins, vrange, log, swmr = task
+    try:
+        with open_readonly(filename, swmr=swmr) as h5f:
+            dset = h5f[path]
+            lo, hi = vrange or value_range(dset, block_size, log)
+            if lo is None:
+                return lo, hi, None
+            edges = bin_edges(lo, hi, bins, log)
+            return lo, hi, histogram(dset, edges, block_size)
+    except Exception as err:
+        return err
+
+
+def parallel_map(func, tasks, jobs):
+    """Lazily map `func` on `tasks` with a pool of `jobs` processes
+
+    Results are yielded in the order of `tasks`, as soon as available.
+    Processes are spawned (not forked) so that no HDF5 state is shared.
+    """
+    import multiprocessing
+    try:
+        context = multiprocessing.get_context('spawn')
+    except AttributeError:
+        context = multiprocessing
+    tasks = list(tasks)
+    if not tasks:
+        return
+    pool = context.Pool(max(1, min(jobs, len(tasks))))
+    try:
+        for result in pool.imap(func, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def axis_chunks(length, chunk, sel):
+    """Number of chunks of one axis touched by an index or slice"""
+    if not isinstance(sel, slice):
+        return 1
+    indices = range(*sel.indices(length))
+    if len(indices) == 0:
+        return 0
+    if abs(indices.step) >= chunk:
+        return len(indices)
+    first, last = sorted((indices[0], indices[-1]))
+    return last // chunk - first // chunk + 1
+
+
+def selection_chunks(shape, chunks, sel):
+    """Number of chunks touched by selection `sel` (tuple of slices/ints)"""
+    sel = tuple(sel) + (slice(None),) * (len(shape) - len(sel))
+    return int(np.prod([axis_chunks(n, c, s)
+                        for n, c, s in zip(shape, chunks, sel)]))
+
+
+def chunk_sizes(dset, limit=100000):
+    """Stored sizes of the allocated chunks of a dataset
+
+    Sizes are read from the chunk index only (never data). Above `limit`
+    allocated chunks, an evenly spaced sample of them is returned.
+    """
+    dsid = dset.id
+    if hasattr(dsid, 'chunk_iter'):
+        sizes = []
+        try:
+            dsid.chunk_iter(lambda info: sizes.append(info.size))
+            return np.array(sizes, dtype=np.int64)
+        except (RuntimeError, NotImplementedError):
+            pass
+    count = dsid.get_num_chunks()
+    indices = np.unique(np.linspace(0, count - 1, min(count, limit),
+                                    dtype=np.int64)) if count else []
+    return np.array([dsid.get_chunk_info(int(i)).size for i in indices],
+                    dtype=np.int64)
+
+
+def selection_size(shape, sel):
+    """Number of elements selected by `sel` (tuple of slices/ints)"""
+    sel = tuple(sel) + (slice(None),) * (len(shape) - len(sel))
+    return int(np.prod([len(range(*s.indices(n))) if isinstance(s, slice)
+                        else 1 for n, s in zip(shape, sel)]))
+
+
+def _axis_ranges(length, sel):
+    """Indices selected on one axis, as a range (None for an index)"""
+    if isinstance(sel, slice):
+        return range(*sel.indices(length))
+    return None
+
+
+def _as_slice(indices):
+    """Convert a non empty range to the equivalent slice"""
+    return slice(indices[0], indices[-1] + 1, indices.step)
+
+
+def read_preview(dset, sel=(), edgeitems=3, threshold=1000):
+    """Read selection `sel` of `dset`, or only the part numpy would print
+
+    Up to `threshold` selected elements, the selection is read and
+    returned as is, with False. Above, numpy only prints `edgeitems` items
+    at both ends of each long axis: only those are read and returned,
+    with a dummy item in between standing for the elided part, and True.
+    Printing the result with threshold=0 then gives exactly the repr
+    numpy would give of the whole selection.
+    """
+    shape = dset.shape
+    sel = tuple(sel) + (slice(None),) * (len(shape) - len(sel))
+    if len(sel) > len(shape):
+        raise IndexError("too many indices for dataset")
+    ranges = [_axis_ranges(n, s) for n, s in zip(shape, sel)]
+    if any(r is not None and r.step < 0 for r in ranges):
+        raise ValueError("negative steps are not supported")
+    size = int(np.prod([len(r) for r in ranges if r is not None]))
+    if size <= threshold or size == 0:
+        return dset[sel if sel else ()], False
+
+    segments = []
+    for index, indices in zip(sel, ranges):
+        if indices is None:
+            segments.append([index])
+        elif len(indices) > 2 * edgeitems:
+            segments.append([_as_slice(indices[:edgeitems]),
+                             _as_slice(indices[-edgeitems:])])
+        else:
+            segments.append([_as_slice(indices)])
+    kept = [r for r in ranges if r is not None]
+    out_shape = [min(len(r), 2 * edgeitems) for r in kept]
+    out = None
+    for corner in itertools.product(*[enumerate(seg) for seg in segments]):
+        part = dset[tuple(s for _, s in corner)]
+        if out is None:
+            out = np.empty(out_shape, dtype=part.dtype)
+        dest = tuple(slice(i * edgeitems, i * edgeitems + n)
+                     for (i, s), n in zip(
+                         [c for c, r in zip(corner, ranges) if r is not None],
+                         np.shape(part)))
+        out[dest] = part
+    for axis, indices in enumerate(kept):
+        if len(indices) > 2 * edgeitems:
+            out = np.insert(out, edgeitems,
+                            out.take(edgeitems - 1, axis=axis), axis=axis)
+    return out, True
+
+
+def dump_npy(dset, fname, block_size=BLOCK_SIZE):
+    """Write a dataset to .npy file `fname`, block by block
+
+    The file is pre-allocated with numpy's open_memmap, then each block is
+    read by HDF5 straight into the mapped file. Datasets numpy can not map
+    (object dtypes such as variable length strings, scalars) are saved in
+    one go.
+    """
+    if dset.dtype.hasobject or not dset.shape or dset.size == 0:
+        with open(fname, 'wb') as fout:
+            np.save(fout, dset[()])
+        return
+    out = np.lib.format.open_memmap(fname, mode='w+', dtype=dset.dtype,
+                                    shape=dset.shape)
+    try:
+        for sel in iter_slices(dset.shape, block_shape(dset, block_size)):
+            dset.read_direct(out, source_sel=sel, dest_sel=sel)
+        out.flush()
+    finally:
+        del out
+
+
+def dump_task(task):
+    """Worker: dump dataset `path` of file `filename` to .npy file `fname`"""
+    filename, path, fname, block_size, swmr = task
+    try:
+        with open_readonly(filename, swmr=swmr) as h5f:
+            dump_npy(h5f[path], fname, block_size)
+        return fname
+    except Exception as err:
+        return err
+
+
+def dump_txt(dset, fname, fmt='%.18e', delimiter=' ', header=None,
+             block_size=BLOCK_SIZE):
+    """Write a numeric dataset to text file `fname`, block by block
+
+    The layout is the one of numpy.savetxt: one line per item of the first
+    axis, further axes flattened into columns, complex values written as
+    (real+imagj). Blocks of `block_size` bytes are read, and formatted by
+    slices of an eighth of that, as the text and the intermediate Python
+    floats take several times the memory of the binary values. Returns the
+    number of bytes written.
+    """
+    kind = dset.dtype.kind
+    if kind not in 'biufc':
+        raise TypeError("text dump undefined for dtype " + str(dset.dtype))
+    shape = dset.shape if dset.shape else (1,)
+    ncols = int(np.prod(shape[1:]))
+    row_bytes = max(ncols * dset.dtype.itemsize, 1)
+    rows = max(block_size // row_bytes, 1)
+    text_rows = max(block_size // 8 // row_bytes, 1)
+    if kind == 'c':
+        fmt = ' ({0}+{0}j)'.format(fmt)
+    line = delimiter.join([fmt] * ncols) + '\n'
+
+    def format_rows(block):
+        values = np.ascontiguousarray(block)
+        if kind == 'c':
+            values = values.view(values.real.dtype)
+        text = (line * len(block)) % tuple(values.ravel().tolist())
+        return text.replace('+-', '-') if kind == 'c' else text
+
+    written = 0
+    with open(fname, 'w', 1024 ** 2) as fout:
+        if header is not None:
+            written += fout.write(header + '\n') or 0
+        if not dset.shape:
+            text = format_rows(np.asarray(dset[()]).reshape(1, 1))
+            return written + (fout.write(text) or 0)
+        for start in range(0, shape[0], rows):
+            block = dset[start:start + rows]
+            for first in range(0, len(block), text_rows):
+                text = format_rows(block[first:first + text_rows])
+                fout.write(text)
+                written += len(text)
+    return written
+
+
+class Predicate(object):
+    """Boolean expression of the values `x` of a dataset, such as
+    "x > 3000 | isnan(x)", evaluated with numpy on whole blocks
+
+    `|`, `&` and `~` are read as `or`, `and` and `not` (with their lower
+    precedence, so that comparisons need no parentheses) and all apply
+    element-wise, as do chained comparisons (0 < x < 1). Fields of
+    compound datasets are available by name. Only numbers, the names
+    below and the functions of FUNCTIONS are accepted: the expression is
+    walked node by node, never passed to eval.
+    """
+    FUNCTIONS = ['abs', 'sqrt', 'exp', 'log', 'log10', 'sin', 'cos', 'tan',
+                 'floor', 'ceil', 'sign', 'real', 'imag', 'isnan', 'isinf',
+                 'isfinite']
+    CONSTANTS = {'nan': float('nan'), 'inf': float('inf'),
+                 'pi': 3.141592653589793, 'e': 2.718281828459045,
+                 'True': True, 'False': False}
+    OPERATORS = {'Add': operator.add, 'Sub': operator.sub,
+                 'Mult': operator.mul, 'Div': operator.truediv,
+                 'FloorDiv': operator.floordiv, 'Mod': operator.mod,
+                 'Pow': operator.pow, 'Lt': operator.lt, 'LtE': operator.le,
+                 'Gt': operator.gt, 'GtE': operator.ge, 'Eq': operator.eq,
+                 'NotEq': operator.ne, 'USub': operator.neg,
+                 'UAdd': operator.pos}
+
+    def __init__(self, expr):
+        self.expr = expr
+        text = expr.replace('|', ' or ').replace('&', ' and ')
+        text = text.replace('~', ' not ')
+        try:
+            self.tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError as err:
+            raise ValueError("invalid expression: " + str(err.msg))
+
+    def __call__(self, block):
+        """Boolean mask of the items of ndarray `block`"""
+        block = np.asarray(block)
+        result = np.asarray(self._eval(self.tree.body, block))
+        if result.dtype.kind != 'b':
+            raise ValueError("expression is not a condition: " + self.expr)
+        return np.broadcast_to(result, block.shape)
+
+    def _eval(self, node, x):
+        kind = node.__class__.__name__
+        if kind == 'BoolOp':
+            func = np.logical_and if kind_of(node.op) == 'And' \
+                else np.logical_or
+            values = [self._eval(value, x) for value in node.values]
+            result = values[0]
+            for value in values[1:]:
+                result = func(result, value)
+            return result
+        if kind == 'UnaryOp':
+            value = self._eval(node.operand, x)
+            if kind_of(node.op) == 'Not':
+                return np.logical_not(value)
+            return self._operator(node.op)(value)
+        if kind == 'BinOp':
+            return self._operator(node.op)(self._eval(node.left, x),
+                                           self._eval(node.right, x))
+        if kind == 'Compare':
+            left, result = self._eval(node.left, x), True
+            for op, right in zip(node.ops, node.comparators):
+                right = self._eval(right, x)
+                result = np.logical_and(result,
+                                        self._operator(op)(left, right))
+                left = right
+            return result
+        if kind == 'Call':
+            name = getattr(node.func, 'id', None)
+            if name not in self.FUNCTIONS or getattr(node, 'keywords', None):
+                raise ValueError("unknown function: {}".format(
+                    name or kind_of(node.func)))
+            return getattr(np, name)(*[self._eval(arg, x)
+                                       for arg in node.args])
+        if kind == 'Name':
+            if node.id == 'x':
+                return x
+            if x.dtype.names and node.id in x.dtype.names:
+                return x[node.id]
+            if node.id in self.CONSTANTS:
+                return self.CONSTANTS[node.id]
+            raise ValueError("unknown name: " + node.id)
+        if kind in ('Num', 'Constant', 'NameConstant'):
+            value = getattr(node, 'value', getattr(node, 'n', None))
+            if isinstance(value, (bool, int, float, complex)):
+                return value
+        raise ValueError("unsupported expression: " + kind)
+
+    def _operator(self, op):
+        try:
+            return self.OPERATORS[kind_of(op)]
+        except KeyError:
+            raise ValueError("unsupported operator: " + kind_of(op))
+
+
+def kind_of(node):
+    return node.__class__.__name__
+
+
+def where(dset, predicate, block_size=BLOCK_SIZE, first=0, bbox=False,
+          out=None):
+    """Items of `dset` matching `predicate`, evaluated block by block
+
+    Returns (count, indices, box): the number of matching items, the
+    indices of the `first` ones in C order, and if `bbox` the bounding
+    box of all of them, as a list of (start, stop) per axis (None if
+    nothing matches). With `out` (a dataset of the same shape), the
+    boolean mask is written to it block by block.
+    """
+    count, indices, box = 0, [], None
+    for sel, block in iter_blocks(dset, block_size):
+        mask = predicate(block)
+        if out is not None:
+            out[sel] = mask
+        found = int(np.count_nonzero(mask))
+        if not found:
+            continue
+        count += found
+        offsets = [axis.start for axis in sel]
+        if first:
+            flat = np.flatnonzero(mask)[:first]
+            local = np.unravel_index(flat, mask.shape)
+            indices.extend(zip(*[(pos + off).tolist()
+                                 for pos, off in zip(local, offsets)]))
+            indices = sorted(indices)[:first]
+        if bbox:
+            limits = []
+            for axis, off in enumerate(offsets):
+                others = tuple(a for a in range(mask.ndim) if a != axis)
+                hits = np.flatnonzero(mask.any(axis=others))
+                limits.append((int(hits[0]) + off, int(hits[-1]) + off + 1))
+            box = limits if box is None else [
+                (min(lo, new_lo), max(hi, new_hi))
+                for (lo, hi), (new_lo, new_hi) in zip(box, limits)]
+    return count, indices, box
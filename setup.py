@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import re
 from setuptools import setup, find_packages
 from codecs import open
 from os.path import isfile, join, abspath, dirname
@@ -7,9 +8,12 @@ from os.path import isfile, join, abspath, dirname
 with open("README.md", encoding='utf-8') as f:
     long_description = f.read()
 
+with open(join("h5nav", "__init__.py"), encoding='utf-8') as f:
+    version = re.search(r'__version__ = "(.*)"', f.read()).group(1)
+
 setup(
     name="h5nav",
-    version="0.1.6",
+    version=version,
     packages=find_packages(exclude=['docs']),
     entry_points={
         'console_scripts': [
@@ -3,7 +3,7 @@ import sys
 import pytest
 
 import numpy as np
-from h5py import File
+from h5py import File, SoftLink
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
                                                 '..')))
@@ -30,5 +30,36 @@ def teardown_module():
 @pytest.fixture(scope="function")
 def interp():
     interpreter = cli.H5NavCmd()
+    interpreter.prefetching = False
     interpreter.do_open("dummy.h5")
     return interpreter
+
+
+@pytest.fixture(scope="function")
+def chunked(tmp_path):
+    """Interpreter on a file holding chunked and contiguous 2D datasets"""
+    fname = str(tmp_path / "chunked.h5")
+    data = np.random.RandomState(0).normal(300., 20., (200, 30))
+    with File(fname, 'w') as h5f:
+        h5f.create_dataset("chunked", data=data, chunks=(16, 7))
+        h5f.create_dataset("contiguous", data=data)
+    interpreter = cli.H5NavCmd()
+    interpreter.prefetching = False
+    interpreter.do_open(fname)
+    interpreter.data = data
+    return interpreter
+
+
+@pytest.fixture(scope="function")
+def linked(tmp_path):
+    """Interpreter on a file where a group is reached through links"""
+    fname = str(tmp_path / "linked.h5")
+    with File(fname, 'w') as h5f:
+        h5f.create_group("a")
+        h5f["a/d"] = np.arange(10)
+        h5f["hard"] = h5f["a"]
+        h5f["link"] = SoftLink("/a")
+    interpreter = cli.H5NavCmd()
+    interpreter.prefetching = False
+    interpreter.do_open(fname)
+    return interpreter
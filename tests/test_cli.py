@@ -1,8 +1,16 @@
 import os
+import sys
+import json
+import subprocess
+from fnmatch import fnmatchcase
 import pytest
 import numpy as np
 
-from .context import cli, setup_module, teardown_module, interp
+from h5py import File
+from .context import (cli, setup_module, teardown_module, interp, chunked,
+                      linked)
+from h5nav.index import Entry, TreeIndex, match_shape, match_size
+from h5nav.stream import Moments, block_shape, dump_txt, iter_blocks
 
 
 # `get_whitespace_name` command
@@ -27,6 +35,16 @@ def test_helps_work(capsys, interp):
         assert hasattr(interp, cmd)
 
 
+# metadata cache
+def test_children_cache(interp):
+    interp.do_cd("Group1")
+    interp.do_cd("Subgroup1")
+    assert interp.children() == {"field1": "Dataset", " field2": "Dataset"}
+    assert sorted(interp._children) == ["/", "/Group1/", "/Group1/Subgroup1/"]
+    interp.invalidate("/Group1/Subgroup1")
+    assert sorted(interp._children) == ["/"]
+
+
 # `ls` command
 def test_ls_simple(capsys, interp):
     interp.do_ls('')
@@ -54,6 +72,76 @@ def test_ls_unknown_label(capsys, interp):
     #     interp.do_ls('zzz')
 
 
+def test_ls_recursive(capsys, interp):
+    interp.do_ls('-R')
+    out, err = capsys.readouterr()
+    assert out == """\
+/:
+ Group2/ Group1/
+
+/ Group2:
+field1
+
+/Group1:
+Subgroup1/ field1
+
+/Group1/Subgroup1:
+ field2 field1
+"""
+    interp.do_ls('-R -l Group1')
+    out, err = capsys.readouterr()
+    assert out.split("\n")[:3] == [
+        "/Group1:",
+        "       -  -                -          Subgroup1/",
+        "      8B  scalar           object     field1"]
+    interp.do_ls('-R -L 1')
+    out, err = capsys.readouterr()
+    assert "/Group1:" in out and "/Group1/Subgroup1:" not in out
+
+
+def test_ls_recursive_links(capsys, linked):
+    for command in ("-R link", "-R hard"):
+        linked.do_ls(command)
+        out, err = capsys.readouterr()
+        assert out == "/a:\nd\n"
+    linked.do_cd("link")
+    linked.do_ls("-R")
+    out, err = capsys.readouterr()
+    assert out == "/a:\nd\n"
+    linked.do_ls("-R /")
+    out, err = capsys.readouterr()
+    assert out == "/:\na/\n\n/a:\nd\n"
+    linked.onecmd("ls -l")
+    out, err = capsys.readouterr()
+    assert out.startswith("*** -l and -L only apply")
+
+
+def test_tree(capsys, interp):
+    interp.do_tree('')
+    out, err = capsys.readouterr()
+    assert out == """\
+/
+|--  Group2/
+|   `-- field1  10 float64 80B
+`-- Group1/
+    |-- Subgroup1/
+    |   |--  field2  100 int64 800B
+    |   `-- field1  100 int64 800B
+    `-- field1  scalar object 8B
+
+3 groups, 4 datasets
+"""
+    interp.do_tree('-d -L 1')
+    out, err = capsys.readouterr()
+    assert out == "/\n|--  Group2/\n`-- Group1/\n\n2 groups, 0 datasets\n"
+
+
+def test_tree_links(capsys, linked):
+    linked.do_tree("link")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[:2] == ["/link", "`-- d  10 int64 80B"]
+
+
 # `cd` command
 def test_cd_group(interp):
     assert interp.position == '/'
@@ -81,6 +169,23 @@ def test_cd_root(interp):
     assert interp.position == '/'
 
 
+def test_cd_slash_and_dot(interp):
+    interp.do_cd('/')
+    assert interp.position == '/'
+    interp.do_cd('.')
+    assert interp.position == '/'
+    interp.do_cd('Group1')
+    interp.do_cd('Subgroup1')
+    interp.do_cd('.')
+    assert interp.position == '/Group1/Subgroup1/'
+    interp.do_cd('../..')
+    assert interp.position == '/'
+    interp.do_cd('/')
+    interp.do_cd('Group1')
+    assert interp.position == '/Group1/'
+    assert interp.last_pos == '/'
+
+
 def test_cd_2args(capsys, interp):
     interp.do_cd('Group1 Group2')
     out, err = capsys.readouterr()
@@ -124,6 +229,42 @@ field1 :
 """
 
 
+def test_cat_selection(capsys, interp):
+    interp.do_cd("Group1")
+    interp.do_cd("Subgroup1")
+    interp.do_cat("field1[10:20, ]")
+    interp.do_cat("field1[::30]")
+    out, err = capsys.readouterr()
+    assert out == "[10 11 12 13 14 15 16 17 18 19]\n[ 0 30 60 90]\n"
+    interp.do_cat("field1[0, 1]")
+    out, err = capsys.readouterr()
+    assert out.startswith("*** invalid selection")
+
+
+def test_cat_preview(capsys, monkeypatch, chunked):
+    read = []
+    getitem = type(chunked.get_elem("chunked")).__getitem__
+
+    def spy(dset, sel):
+        data = getitem(dset, sel)
+        read.append(np.size(data))
+        return data
+    monkeypatch.setattr(type(chunked.get_elem("chunked")), "__getitem__", spy)
+    chunked.do_cat("chunked")
+    out, err = capsys.readouterr()
+    assert out == str(chunked.data) + "\n"
+    assert sum(read) == 36
+
+
+def test_head_tail(capsys, interp):
+    interp.do_cd("Group1")
+    interp.do_cd("Subgroup1")
+    interp.do_head("-n 3 field1")
+    interp.do_tail("field1")
+    out, err = capsys.readouterr()
+    assert out == "[0 1 2]\n[90 91 92 93 94 95 96 97 98 99]\n"
+
+
 # `stats` command
 def test_stats(capsys, interp):
     interp.do_cd("Group1")
@@ -137,6 +278,65 @@ int64  4.9500e+01 +/-  5.7732e+01 [ 0.0000e+00,  9.9000e+01] (100,)
 """
 
 
+def test_stats_streamed(capsys, chunked):
+    chunked.do_blocksize('2K')
+    capsys.readouterr()
+    for name in ("chunked", "contiguous"):
+        chunked.do_stats(name)
+        out, err = capsys.readouterr()
+        data = chunked.data
+        assert out.split("\n")[2] == (
+            "float64 {0: 5.4e} +/- {1: 5.4e} [{2: 5.4e}, {3: 5.4e}] "
+            "(200, 30)".format(data.mean(), 2 * data.std(),
+                               data.min(), data.max()))
+
+
+def test_stats_parallel(capsys, chunked):
+    chunked.do_stats("*")
+    serial = capsys.readouterr()[0]
+    chunked.do_stats("-j 2 *")
+    out, err = capsys.readouterr()
+    assert out == serial
+    assert out.split("\n")[2] == "chunked :"
+    assert out.split("\n")[4] == "contiguous :"
+
+
+def test_stats_errors(capsys, monkeypatch, interp):
+    interp.do_stats("Group1/field1")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[2] == "object Undef +/- Undef [Undef, Undef] ()"
+
+    def fail(*args):
+        raise ValueError("unreadable")
+    monkeypatch.setattr(cli, "moments", fail)
+    status = cli.run_commands(interp, ["cd Group1/Subgroup1", "stats *"])
+    out, err = capsys.readouterr()
+    assert status == 1
+    assert out.split("\n")[2:6] == [" field2 :", "    *** unreadable",
+                                     "field1 :", "    *** unreadable"]
+
+
+def test_block_shape(chunked):
+    dset = chunked.get_elem("chunked")
+    assert block_shape(dset, 8 * 16 * 7) == (16, 7)
+    assert block_shape(dset, 8 * 16 * 30) == (16, 30)
+    assert block_shape(dset, 8 * 32 * 30) == (32, 30)
+    dset = chunked.get_elem("contiguous")
+    assert block_shape(dset, 8 * 30 * 3) == (3, 30)
+    assert sum(b.size for _, b in iter_blocks(dset, 1000)) == 6000
+
+
+def test_moments_merge():
+    data = np.random.RandomState(1).uniform(-1., 1., 1000) + 1e8
+    mom = Moments()
+    for part in np.array_split(data, 7):
+        mom.update(part)
+    assert mom.count == 1000
+    assert np.isclose(mom.mean, data.mean(), rtol=0, atol=1e-7)
+    assert np.isclose(mom.std, data.std())
+    assert (mom.min, mom.max) == (data.min(), data.max())
+
+
 # `pdf` command
 def test_pdf(capsys, interp):
     interp.do_cd("Group1")
@@ -150,6 +350,56 @@ Min         Max         | Pdf (10 buckets)
 """
 
 
+def test_pdf_undefined(capsys, tmp_path):
+    fname = str(tmp_path / "types.h5")
+    with File(fname, 'w') as h5f:
+        h5f["c"] = np.arange(4) * 1j
+        h5f["s"] = "text"
+    interp = cli.H5NavCmd()
+    interp.prefetching = False
+    interp.do_open(fname)
+    capsys.readouterr()
+    interp.do_pdf("c")
+    interp.do_pdf("-r 0 1 s")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[2] == \
+        "PDF does not apply: range undefined for dtype complex128"
+    assert out.split("\n")[5] == \
+        "PDF does not apply: histogram undefined for dtype |S4"
+    interp.do_close()
+
+
+def test_pdf_streamed(capsys, chunked):
+    chunked.do_blocksize('1K')
+    capsys.readouterr()
+    chunked.do_pdf("-b 25 chunked")
+    out, err = capsys.readouterr()
+    counts = np.histogram(chunked.data, bins=25)[0].tolist()
+    assert out.split("\n")[2].endswith("| " + str(counts))
+
+
+def test_pdf_range_log(capsys, chunked):
+    chunked.do_pdf("-b 4 -r 250 350 -l contiguous")
+    out, err = capsys.readouterr()
+    edges = np.logspace(np.log10(250), np.log10(350), 5)
+    counts = np.histogram(chunked.data, bins=edges)[0].tolist()
+    assert out.split("\n")[0].endswith("Pdf (4 log buckets)")
+    assert out.split("\n")[2] == " 2.5000e+02  3.5000e+02 | " + str(counts)
+
+
+def test_pdf_parallel(capsys, chunked):
+    chunked.do_pdf("-b 5 *")
+    serial = capsys.readouterr()[0]
+    chunked.do_pdf("-b 5 -j 2 *")
+    out, err = capsys.readouterr()
+    assert out == serial
+
+
+def test_pdf_bad_option(interp):
+    with pytest.raises(AssertionError):
+        interp.do_pdf("-b zz field1")
+
+
 # `dump` command
 def test_dump(interp):
     fname = "field1.npy"
@@ -160,6 +410,25 @@ def test_dump(interp):
     os.remove(fname)
 
 
+def test_dump_streamed(chunked, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    chunked.do_blocksize("1K")
+    chunked.do_dump("-j 2 *")
+    chunked.do_dump("chunked")
+    for name in ("chunked", "contiguous"):
+        assert np.array_equal(np.load(name + ".npy"), chunked.data)
+
+
+def test_dump_path(capsys, interp, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    interp.do_dump("/Group1/Subgroup1/field1")
+    interp.do_txt_dump("Group1/Subgroup1/field1")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[0] == "--- file saved to field1.npy"
+    assert np.array_equal(np.load("field1.npy"), np.arange(100))
+    assert np.array_equal(np.loadtxt("field1.txt"), np.arange(100))
+
+
 # `txt_dump` command
 def test_txt_dump(interp):
     fname = "field1.txt"
@@ -169,17 +438,551 @@ def test_txt_dump(interp):
     assert np.allclose(data, np.zeros(10))
     os.remove(fname)
 
+
+def test_txt_dump_csv(chunked, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    chunked.do_blocksize("1K")
+    chunked.do_txt_dump("-d comma -p 12 --header *")
+    for name in ("chunked", "contiguous"):
+        with open(name + ".txt") as fin:
+            header = fin.readline().strip().split(",")
+        assert header[:2] == [name + "[0]", name + "[1]"]
+        data = np.loadtxt(name + ".txt", delimiter=",", skiprows=1)
+        assert np.allclose(data, chunked.data, rtol=1e-12)
+
+
+def test_txt_dump_complex(tmp_path):
+    data = (np.arange(24) - 12.5j * np.arange(24)).reshape(8, 3)
+    with File(str(tmp_path / "complex.h5"), "w") as h5f:
+        h5f["z"] = data
+        nbytes = dump_txt(h5f["z"], str(tmp_path / "z.txt"), block_size=64)
+    np.savetxt(str(tmp_path / "ref.txt"), data)
+    with open(str(tmp_path / "z.txt")) as fin, \
+            open(str(tmp_path / "ref.txt")) as fref:
+        text = fin.read()
+        assert text == fref.read()
+    assert nbytes == len(text)
+
+
+# `find` command
+def test_find(capsys, interp):
+    interp.do_find("-name field1")
+    out, err = capsys.readouterr()
+    assert out.split("\n") == ["/ Group2/field1", "/Group1/Subgroup1/field1",
+                                "/Group1/field1", ""]
+    interp.do_find("Group1 -type f -dtype int -shape 100")
+    out, err = capsys.readouterr()
+    assert out.split("\n") == ["/Group1/Subgroup1/ field2",
+                                "/Group1/Subgroup1/field1", ""]
+    interp.do_find("-regex Sub -type d")
+    out, err = capsys.readouterr()
+    assert out == "/Group1/Subgroup1/\n"
+
+
+def test_find_size(capsys, chunked):
+    chunked.do_find("-size +40K -name *ig*")
+    out, err = capsys.readouterr()
+    assert out == "/contiguous\n"
+
+
+def test_find_indexed():
+    entries = [Entry("/", "Group", None, None, None, None, 0)]
+    for g in range(5):
+        entries.append(Entry("/g%d" % g, "Group", None, None, None, None, 0))
+        for d in range(40):
+            n = (d % 3 + 1) * 10
+            entries.append(Entry("/g%d/d%d" % (g, d), "Dataset", (n,),
+                                 ("int32", "float64")[d % 2], None, None,
+                                 n * 4))
+    index = TreeIndex(entries)
+    queries = [dict(name="d1*"), dict(name="d12"), dict(name="*3?"),
+               dict(dtype="int"), dict(shape=(None,)), dict(kind="Group"),
+               dict(size=(">", 40)), dict(size=("<", 120)),
+               dict(size=("=", 80)), dict(root="/g3", name="d2*"),
+               dict(name="d1*", dtype="float", shape=(20,), size=(">", 0))]
+    def matches(entry, root="/", name="*", kind=None, dtype=None,
+                shape=None, size=None):
+        if entry.path == root or \
+                not entry.path.startswith(root.rstrip("/") + "/"):
+            return False
+        if not fnmatchcase(entry.path.rsplit("/", 1)[1], name):
+            return False
+        if kind is not None and entry.kind != kind:
+            return False
+        if dtype is not None and not (entry.dtype or "").startswith(dtype):
+            return False
+        if shape is not None and not match_shape(entry.shape, shape):
+            return False
+        return size is None or match_size(entry.nbytes, *size)
+    for query in queries:
+        found = [e.path for e in index.find(**query)]
+        assert found == sorted(e.path for e in entries
+                               if matches(e, **query)), query
+    index.remove("/g1")
+    index.add(Entry("/g0/new", "Dataset", (7,), "int8", None, None, 7))
+    assert [e.path for e in index.find(dtype="int8")] == ["/g0/new"]
+    # only the candidates of the most selective index are checked
+    assert index._candidates("/", None, None, "int8", None, None) == [
+        "/g0/new"]
+    assert len(index._candidates("/", "d1*", None, None, None,
+                                 (">", 100))) == 4 * 11
+    assert not list(index.find(root="/g1"))
+
+
+# sidecar cache
+def test_sidecar(capsys, monkeypatch, tmp_path, chunked):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    fname = chunked.h5file.filename
+    chunked.do_close()
+    chunked.do_open("--cache " + fname)
+    chunked.do_stats("chunked")
+    first = capsys.readouterr()[0]
+    chunked.do_close()
+
+    def fail(*args):
+        raise RuntimeError("file was read again")
+    monkeypatch.setattr(cli.TreeIndex, "from_file", fail)
+    monkeypatch.setattr(cli, "moments", fail)
+    chunked.do_open("--cache " + fname)
+    assert len(chunked.index) == 3
+    chunked.do_stats("chunked")
+    assert capsys.readouterr()[0] == first
+
+
+@pytest.mark.parametrize("maxshape", [None, (None,)])
+def test_sidecar_rewritten(capsys, monkeypatch, tmp_path, maxshape):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    fname = str(tmp_path / "rewritten.h5")
+    with File(fname, 'w') as h5f:
+        h5f.create_dataset("T", data=np.zeros(100), maxshape=maxshape)
+    interp = cli.H5NavCmd()
+    interp.do_open("--cache " + fname)
+    interp.do_stats("T")
+    interp.do_close()
+    with File(fname, 'r+') as h5f:
+        h5f["T"][...] = np.arange(100.)
+    os.utime(fname, (0, 1e9))
+    interp.do_open("--cache " + fname)
+    capsys.readouterr()
+    interp.do_stats("T")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[2].startswith("float64  4.9500e+01")
+    interp.do_close()
+
+
+def test_sidecar_external_writer(capsys, monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    fname = str(tmp_path / "shared.h5")
+    with File(fname, 'w') as h5f:
+        h5f["T"] = np.zeros(10)
+    interp = cli.H5NavCmd()
+    interp.do_open("--cache " + fname)
+    writer = ("from h5py import File\n"
+              "with File({!r}, 'r+') as h5f:\n"
+              "    h5f['U'] = [1.]\n").format(fname)
+    env = dict(os.environ, HDF5_USE_FILE_LOCKING="FALSE")
+    subprocess.check_call([sys.executable, "-c", writer], env=env)
+    os.utime(fname, (0, 1e9))
+    interp.do_close()
+    interp.do_open("--cache " + fname)
+    capsys.readouterr()
+    interp.do_find("-type f")
+    out, err = capsys.readouterr()
+    assert out == "/T\n/U\n"
+    interp.do_close()
+
+
+def test_sidecar_open_failure(capsys, monkeypatch, tmp_path, chunked):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    bad = tmp_path / "bad.h5"
+    bad.write_text(u"not hdf5")
+    fname = chunked.path
+    chunked.do_open("--cache " + str(bad))
+    out, err = capsys.readouterr()
+    assert out.startswith("*** could not open")
+    assert chunked.sidecar is None
+    chunked.do_open(fname)
+    assert chunked.h5file is not None and chunked.sidecar is None
+
+
+# `du` command
+def test_du(capsys, chunked):
+    chunked.do_du("-s disk")
+    out, err = capsys.readouterr()
+    lines = [line.split() for line in out.split("\n")]
+    assert lines[0] == ["On", "disk", "Logical", "Ratio", "Path"]
+    assert lines[1][1:] == ["96000", "0.90", "/"]
+    assert lines[3] == ["48000", "48000", "1.00", "/contiguous"]
+    assert lines[4][:2] == ["File", "size"]
+    chunked.do_du("-h -d 0")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[1].split() == ["103.8K", "93.8K", "0.90", "/"]
+
+
+def test_du_links(capsys, linked):
+    for commands in (["du link"], ["du hard"], ["cd link", "du"]):
+        for line in commands:
+            linked.onecmd(line)
+        out, err = capsys.readouterr()
+        lines = [line.split() for line in out.split("\n")]
+        assert lines[1:3] == [["80", "80", "1.00", "/a/"],
+                              ["80", "80", "1.00", "/a/d"]]
+
+
+# `chunks` command
+def test_chunks(capsys, chunked):
+    chunked.do_chunks("chunked[0:20, ::10] -a 1")
+    out, err = capsys.readouterr()
+    lines = out.split("\n")
+    assert lines[0] == "/chunked: float64 (200, 30), chunked layout"
+    assert lines[4] == "  chunks        65 allocated / 65"
+    assert lines[7].startswith("  selection     6 chunks")
+    assert lines[8].startswith("  axis 1 lines  200 lines of 5 chunks each")
+
+
+def test_chunks_contiguous(capsys, chunked):
+    chunked.do_chunks("contiguous")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[0].endswith("contiguous layout")
+    assert len(out.split("\n")) == 4
+
+
+def test_selection_chunks():
+    from h5nav.stream import selection_chunks
+    assert selection_chunks((100, 100), (10, 10), (slice(0, 5), 3)) == 1
+    assert selection_chunks((100, 100), (10, 10), (slice(None, None, 20),)) \
+        == 50
+    assert cli.parse_selection("0:10, ::4, 3") == (
+        slice(0, 10), slice(None, None, 4), 3)
+
+
+# `rechunk` command
+def test_rechunk(capsys, chunked):
+    chunked.do_open("-w " + chunked.h5file.filename)
+    chunked.get_elem("contiguous").attrs["units"] = "K"
+    chunked.index
+    chunked.do_blocksize("1K")
+    chunked.do_rechunk("contiguous --chunks 10,4 --compression gzip "
+                       "--shuffle")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[-2].startswith(
+        "--- rechunked /contiguous: chunks (10, 4)")
+    dset = chunked.get_elem("contiguous")
+    assert dset.compression == "gzip" and dset.shuffle
+    assert dset.attrs["units"] == "K"
+    assert np.array_equal(dset[()], chunked.data)
+    assert chunked.datasets == ["chunked", "contiguous"]
+    assert chunked.index["/contiguous"].chunks == (10, 4)
+
+
+def test_rechunk_non_dividing(capsys, monkeypatch, chunked):
+    chunked.do_open("-w " + chunked.h5file.filename)
+    chunked.do_blocksize("1K")
+    blocks = []
+    iter_slices = cli.iter_slices
+
+    def spy(shape, block):
+        blocks.append(block)
+        return iter_slices(shape, block)
+    monkeypatch.setattr(cli, "iter_slices", spy)
+    chunked.do_rechunk("chunked --chunks 15,6")
+    # The common unit of (16, 7) and (15, 6) spans the whole dataset
+    assert blocks and np.prod(blocks[0]) * 8 <= 1024
+    assert blocks[0][0] % 15 == 0 and blocks[0][1] % 6 == 0
+    assert np.array_equal(chunked.get_elem("chunked")[()], chunked.data)
+
+
+def test_common_unit():
+    from h5nav.stream import common_unit
+    assert common_unit((16, 7), (10, 4)) == (80, 28)
+
+
+# batch mode
+def test_batch_commands(capsys):
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["dummy.h5", "-c", "cd /Group1/Subgroup1; cat field1[:3]"])
+    assert exit.value.code == 0
+    out, err = capsys.readouterr()
+    assert out == "[0 1 2]\n"
+
+
+def test_batch_failure(capsys, tmp_path):
+    script = tmp_path / "script.h5nav"
+    script.write_text(u"# comment\ncd zzz\nls\n")
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["dummy.h5", "-s", str(script), "--json", "-k"])
+    assert exit.value.code == 1
+    out, err = capsys.readouterr()
+    records = [json.loads(line) for line in out.splitlines()]
+    assert [r["status"] for r in records] == ["ok", "error", "ok"]
+    assert records[1]["errors"] == ["unknown label"]
+    assert records[2]["output"] == [" Group2/ Group1/"]
+
+
+def test_batch_exit(capsys):
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["dummy.h5", "--json", "-k", "-c", "cd zzz; exit; ls"])
+    assert exit.value.code == 1
+    out, err = capsys.readouterr()
+    records = [json.loads(line) for line in out.splitlines()]
+    assert [(r["command"], r["status"]) for r in records] == [
+        ("open dummy.h5", "ok"), ("cd zzz", "error"), ("exit", "ok")]
+
+
+def test_batch_files(capsys, tmp_path):
+    for i in range(3):
+        with File(str(tmp_path / "solut_{:04d}.h5".format(i)), 'w') as h5f:
+            if i != 1:
+                h5f["T"] = np.full(10, float(i))
+    pattern = str(tmp_path / "solut_*.h5")
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["--files", pattern, "-j", "2", "-c", "stats /T"])
+    assert exit.value.code == 1
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+    assert len(lines) == 7
+    assert lines[2].endswith("solut_0000.h5 | float64  0.0000e+00 +/-  "
+                             "0.0000e+00 [ 0.0000e+00,  0.0000e+00] (10,)")
+    assert lines[3].endswith("solut_0001.h5 | *** unknown label")
+    assert lines[6].split("| ")[1].startswith("float64  2.0000e+00")
+    assert err.startswith("*** 1/3 files failed")
+
+
+# `open` modes
+def test_swmr_refresh(capsys, tmp_path):
+    fname = str(tmp_path / "live.h5")
+    writer = File(fname, 'w', libver='latest')
+    dset = writer.create_dataset("T", data=np.zeros(4), maxshape=(None,),
+                                 chunks=(4,))
+    writer.swmr_mode = True
+    reader = cli.H5NavCmd()
+    reader.do_open("--swmr " + fname)
+    dset.resize((8,))
+    dset[4:] = 1.
+    dset.flush()
+    reader.do_refresh("")
+    reader.do_stats("T")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[0] == "--- refreshed 1 datasets"
+    assert out.split("\n")[3].endswith("(8,)")
+    reader.do_close()
+    writer.close()
+
+
+def test_swmr_jobs(capsys, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = File("live.h5", 'w', libver='latest')
+    for name in ("T", "U"):
+        writer.create_dataset(name, data=np.arange(4.), maxshape=(None,),
+                              chunks=(4,))
+    writer.swmr_mode = True
+    reader = cli.H5NavCmd()
+    reader.do_open("--swmr live.h5")
+    capsys.readouterr()
+    reader.do_stats("-j 2 *")
+    reader.do_pdf("-j 2 -b 2 *")
+    reader.do_dump("-j 2 *")
+    out, err = capsys.readouterr()
+    assert "***" not in out and "Undef" not in out
+    assert np.array_equal(np.load("U.npy"), np.arange(4.))
+    reader.do_close()
+    writer.close()
+
+
+def test_stats_incremental(capsys, monkeypatch, tmp_path):
+    fname = str(tmp_path / "growing.h5")
+    writer = File(fname, 'w', libver='latest')
+    dset = writer.create_dataset("T", data=np.arange(10.), maxshape=(None,),
+                                 chunks=(4,))
+    writer.swmr_mode = True
+    interp = cli.H5NavCmd()
+    interp.do_open("--swmr " + fname)
+    interp.do_stats("T")
+    dset.resize((15,))
+    dset[10:] = np.arange(10., 15.)
+    dset.flush()
+
+    starts = []
+    moments = cli.moments
+
+    def spy(dset, block_size, start=0):
+        starts.append(start)
+        return moments(dset, block_size, start)
+    monkeypatch.setattr(cli, "moments", spy)
+    capsys.readouterr()
+    interp.do_watch("-n 2 stats T 0")
+    out, err = capsys.readouterr()
+    assert starts == [10]
+    assert out.split("\n")[3] == (
+        "float64  7.0000e+00 +/-  8.6410e+00 [ 0.0000e+00,  1.4000e+01] "
+        "(15,)")
+    assert out.split("\n")[4].startswith("--- ")
+    interp.do_close()
+    writer.close()
+
+
+def test_open_tuning(capsys, monkeypatch, tmp_path, chunked):
+    config = tmp_path / "config.ini"
+    config.write_text(u"[h5nav]\nblock_size = 1M\n"
+                      u"[open]\nrdcc_nbytes = 4M\nrdcc_w0 = zz\n")
+    monkeypatch.setenv("H5NAV_CONFIG", str(config))
+    interp = cli.H5NavCmd()
+    out, err = capsys.readouterr()
+    assert "ignoring [open] rdcc_w0" in out
+    assert interp.block_size == 1024 ** 2
+    fname = chunked.h5file.filename
+    interp.do_open("--rdcc-nslots 101 --driver core " + fname)
+    assert interp.h5file.driver == "core"
+    cache = interp.h5file.id.get_access_plist().get_cache()
+    assert cache[1:3] == (101, 4 * 1024 ** 2)
+    interp.do_cache("chunked --rdcc-nbytes 8M")
+    out, err = capsys.readouterr()
+    assert out.startswith("/chunked chunk cache: 8.0M, 101 slots")
+    dapl = interp.get_elem("chunked").id.get_access_plist()
+    assert dapl.get_chunk_cache()[1] == 8 * 1024 ** 2
+
+
+def test_timing(capsys, chunked):
+    chunked.onecmd("timing on")
+    chunked.onecmd("stats chunked")
+    chunked.onecmd("timing off")
+    chunked.onecmd("stats contiguous")
+    out, err = capsys.readouterr()
+    lines = out.split("\n")
+    assert lines[0] == "timing is on"
+    assert lines[4].startswith("--- wall ")
+    assert "datasets opened 1" in lines[4]
+    assert lines[5] == "timing is off"
+    assert not any(l.startswith("--- ") for l in lines[6:])
+
+
+def test_profile(capsys, tmp_path, chunked):
+    output = str(tmp_path / "stats.prof")
+    chunked.onecmd("profile -n 5 -o {} stats chunked".format(output))
+    out, err = capsys.readouterr()
+    assert out.split("\n")[2].startswith("float64")
+    assert "profile written to " + output in out
+    assert "do_stats" in out
+    assert os.path.isfile(output)
+    chunked.onecmd("profile -s nokey stats chunked")
+    out, err = capsys.readouterr()
+    assert out == "*** unknown sort key: nokey\n"
+
+
+def test_complete_path(interp):
+    assert interp.complete_cat("", "cat ", 4, 4) == ["Group1/", "Group2/"]
+    assert interp.complete_cd("Sub", "cd Group1/Sub", 3, 13) == [
+        "Subgroup1/"]
+    line = "stats /Group1/Subgroup1/f"
+    assert interp.complete_stats("f", line, 6, len(line)) == [
+        "field1", "field2"]
+    # Without '/' in the readline delimiters, text is the whole path
+    assert interp.complete_cd("Group1/S", "cd Group1/S", 3, 11) == [
+        "Group1/Subgroup1/"]
+    interp.do_cd("Group1")
+    assert interp.complete_cd("", "cd ../", 3, 6) == ["Group1/", "Group2/"]
+    assert interp.complete_cat("", "cat field1/", 4, 11) == []
+
+
+def test_attrs(capsys, tmp_path):
+    fname = str(tmp_path / "attrs.h5")
+    with File(fname, 'w') as h5f:
+        h5f.attrs["title"] = b"run 1"
+        h5f.create_group("flow").attrs["units"] = "K"
+        h5f["flow/T"] = np.zeros(3)
+        h5f["flow/T"].attrs["units"] = "K"
+        h5f["flow/T"].attrs["dt"] = 1e-3
+        h5f["flow/P"] = np.zeros(3)
+        h5f["flow/P"].attrs["units"] = "Pa"
+    interp = cli.H5NavCmd()
+    interp.do_open(fname)
+    interp.do_attrs("")
+    interp.do_attrs("flow/T")
+    out, err = capsys.readouterr()
+    assert out == "title = run 1\ndt = 0.001\nunits = K\n"
+    interp.do_attrs("-R flow")
+    out, err = capsys.readouterr()
+    assert out.split("\n")[:5] == [
+        "/flow:", "    units = K", "", "/flow/P:", "    units = Pa"]
+    interp.onecmd("where-attr units=K")
+    out, err = capsys.readouterr()
+    assert out == "/flow  units = K\n/flow/T  units = K\n"
+    interp.onecmd("help where-attr")
+    out, err = capsys.readouterr()
+    assert out.startswith("Find objects below a group")
+    interp.onecmd("where_attr dt=1e-3 -type f")
+    interp.onecmd("where-attr units flow -type f")
+    out, err = capsys.readouterr()
+    assert out.split("\n") == ["/flow/T  dt = 0.001", "/flow/P  units = Pa",
+                               "/flow/T  units = K", ""]
+    interp.do_close()
+
+
+def test_where(capsys, chunked):
+    data = chunked.data.copy()
+    data[3, 4] = data[150, 20] = np.nan
+    chunked.do_open("-w " + chunked.h5file.filename)
+    chunked.h5file["chunked"][...] = data
+    chunked.do_blocksize("4K")
+    capsys.readouterr()
+    chunked.do_where('-n 3 --bbox chunked "x > 340 | isnan(x)"')
+    out, err = capsys.readouterr()
+    expected = (data > 340) | np.isnan(data)
+    hits = np.argwhere(expected)
+    lines = out.split("\n")
+    assert lines[0].startswith("/chunked: {} of 6000 items".format(
+        expected.sum()))
+    assert lines[1:4] == ["    " + str(tuple(h)) for h in hits[:3].tolist()]
+    assert lines[4] == "bounding box: [{0}:{1}, {2}:{3}]".format(
+        hits[:, 0].min(), hits[:, 0].max() + 1,
+        hits[:, 1].min(), hits[:, 1].max() + 1)
+    chunked.do_where('--mask nan chunked "~isfinite(x)"')
+    out, err = capsys.readouterr()
+    assert out.split("\n")[1] == "--- mask written to /nan"
+    assert np.array_equal(chunked.h5file["nan"][...], np.isnan(data))
+    chunked.do_where('chunked "x + 1"')
+    chunked.do_where('chunked "__import__(\'os\')"')
+    out, err = capsys.readouterr()
+    assert out == ("*** expression is not a condition: x + 1\n"
+                   "*** unknown function: __import__\n")
+
+
+def test_prefetch(capsys, interp):
+    interp.do_prefetch("on")
+    interp.do_cd("Group1")
+    interp._prefetcher.wait()
+    assert "/Group1/" in interp._children
+    assert list(interp._children["/Group1/Subgroup1/"]) == [
+        " field2", "field1"]
+    interp.do_prefetch("off")
+    interp.do_cd("")
+    interp.do_cd("Group2")
+    interp._prefetcher.wait()
+    assert "/ Group2/" not in interp._children
+    out, err = capsys.readouterr()
+    assert out == "prefetch is on\nprefetch is off\n"
+
+
 # `rm` command
+def test_rm_read_only(interp):
+    with pytest.raises(AssertionError):
+        interp.do_rm("Group1")
+
+
 def test_rm_dataset(capsys, interp):
+    interp.do_open("-w dummy.h5")
     interp.do_cd("Group1")
     interp.do_cd("Subgroup1")
+    assert interp.complete_rm("f", "rm f", 3, 4) == ["field1", "field2"]
     interp.do_rm("field1")
+    assert interp.complete_rm("f", "rm f", 3, 4) == ["field2"]
     interp.do_ls('')
     out, err = capsys.readouterr()
     assert out.split("\n")[1] == " field2"
 
 # `rm` command
 def test_rm_group(capsys, interp):
+    interp.do_open("-w dummy.h5")
     interp.do_rm("Group2")
     interp.do_ls('')
     out, err = capsys.readouterr()
@@ -191,3 +994,4 @@ def test_exit(capsys, interp):
         interp.do_exit('')
     out, err = capsys.readouterr()
     assert out == "Bye!\n"
+
@@ -0,0 +1,35 @@
+"""Guard the startup time of h5nav against heavy imports"""
+import os
+import sys
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+HEAVY = ['numpy', 'h5py', 'pkg_resources', 'sqlite3']
+
+
+def run_python(code, *options):
+    return subprocess.check_output(
+        [sys.executable] + list(options) + ['-c', code], cwd=ROOT,
+        stderr=subprocess.STDOUT, universal_newlines=True)
+
+
+def test_no_heavy_import():
+    out = run_python("import sys, h5nav.cli; "
+                     "print(' '.join(m for m in {} if m in sys.modules))"
+                     .format(HEAVY))
+    assert out.strip() == ""
+
+
+def test_lazy_module_loads_on_use():
+    out = run_python("import sys, h5nav.cli as c; c.np.zeros(1); "
+                     "print('numpy' in sys.modules)")
+    assert out.strip() == "True"
+
+
+def test_import_time():
+    """Cumulative import time of h5nav.cli, read from -X importtime"""
+    out = run_python("import h5nav.cli", "-X", "importtime")
+    line = [l for l in out.splitlines() if l.endswith('| h5nav.cli')][-1]
+    cumulative = int(line.split('|')[1])
+    assert cumulative < 500000, "h5nav.cli took {} us to import".format(
+        cumulative)